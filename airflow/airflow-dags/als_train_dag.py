@@ -32,6 +32,17 @@ with DAG(
             "S3_URI": Variable.get("S3_URI", default_var=""),
             "AWS_ACCESS_KEY_ID": Variable.get("AWS_ACCESS_KEY_ID", default_var=""),
             "AWS_SECRET_ACCESS_KEY": Variable.get("AWS_SECRET_ACCESS_KEY", default_var=""),
+            "SUPABASE_URL": Variable.get("SUPABASE_URL", default_var=""),
+            "SUPABASE_SERVICE_ROLE_KEY": Variable.get("SUPABASE_SERVICE_ROLE_KEY", default_var=""),
+            "ALS_TRAINING_MODE": Variable.get("ALS_TRAINING_MODE", default_var="full"),
+            "ALS_EVENT_LOADER": Variable.get("ALS_EVENT_LOADER", default_var="dataset"),
+            "ALS_INTERACTION_SNAPSHOT": Variable.get("ALS_INTERACTION_SNAPSHOT", default_var="false"),
+            "ALS_SWEEP_FACTORS": Variable.get("ALS_SWEEP_FACTORS", default_var=""),
+            "ALS_SWEEP_REG": Variable.get("ALS_SWEEP_REG", default_var=""),
+            "ALS_SWEEP_ITER": Variable.get("ALS_SWEEP_ITER", default_var=""),
+            "ALS_SWEEP_ALPHA": Variable.get("ALS_SWEEP_ALPHA", default_var=""),
+            "ALS_SWEEP_HOLDOUT_DAYS": Variable.get("ALS_SWEEP_HOLDOUT_DAYS", default_var="7"),
+            "ALS_SWEEP_TOLERANCE": Variable.get("ALS_SWEEP_TOLERANCE", default_var="0.02"),
             "RAY_ADDRESS": "local"
         },
     )
@@ -0,0 +1,135 @@
+"""
+Wall time and peak memory of the ALS preprocessing stage on synthetic events.
+
+Compares the vectorized engine (als_train/preprocessing.py) with the previous
+pandas implementation (dict index maps, per-row weight lambda, groupby). Each
+(size, engine) runs in a fresh subprocess so peak RSS is attributable:
+
+    python benchmarks/preprocess_bench.py --events 10000000,100000000
+
+The legacy engine materialises every id as a Python string, so by default it is
+only run up to --legacy-max-events. Prints one JSON object per run and
+optionally writes them all to --output.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import numpy as np
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "model_training_service", "als_train"))
+
+from preprocessing import EVENT_WEIGHTS, VALID_EVENT_TYPES, build_interactions  # noqa: E402
+
+
+def synthetic_events(num_events, num_users, num_books, seed):
+    """
+    Events shaped like the streaming loader's output. Book popularity is Zipfian
+    and users are log-normally active, so pairs repeat like real reading sessions.
+    """
+    rng = np.random.default_rng(seed)
+    activity = rng.lognormal(sigma=1.0, size=num_users)
+    user_codes = rng.choice(num_users, num_events, p=activity / activity.sum()).astype(np.int32)
+    book_codes = (np.minimum(rng.zipf(1.3, num_events), num_books) - 1).astype(np.int32)
+    type_codes = rng.choice(len(VALID_EVENT_TYPES), num_events, p=[0.2, 0.65, 0.05, 0.1]).astype(np.int8)
+
+    users = pa.array([f"user-{i}" for i in range(num_users)])
+    books = pa.array([f"book-{i}" for i in range(num_books)])
+    return pa.table({
+        "user_id": pa.DictionaryArray.from_arrays(user_codes, users).cast(pa.string()),
+        "item_id": pa.DictionaryArray.from_arrays(book_codes, books).cast(pa.string()),
+        "event_type": pa.DictionaryArray.from_arrays(type_codes, pa.array(VALID_EVENT_TYPES)),
+    })
+
+
+def legacy_preprocess(events):
+    """The pre-vectorization implementation, kept here as the baseline."""
+    df = events.to_pandas()
+    df["event_type"] = df["event_type"].astype(str)
+    df["weight"] = df["event_type"].map(lambda x: EVENT_WEIGHTS.get(x, 1.0))
+    df.rename(columns={"item_id": "book_id"}, inplace=True)
+    df = df.groupby(["user_id", "book_id"], as_index=False)["weight"].sum()
+
+    user_list = df["user_id"].unique().tolist()
+    book_list = df["book_id"].unique().tolist()
+    user_map = {u: i for i, u in enumerate(user_list)}
+    book_map = {b: i for i, b in enumerate(book_list)}
+    df["user_idx"] = df["user_id"].map(user_map)
+    df["book_idx"] = df["book_id"].map(book_map)
+    return df, user_list, book_list
+
+
+ENGINES = {"vectorized": build_interactions, "legacy": legacy_preprocess}
+
+
+def max_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_single(args):
+    events = synthetic_events(args.single_events, args.users, args.books, args.seed)
+    input_rss = max_rss_mb()
+    started = time.perf_counter()
+    df, user_list, book_list = ENGINES[args.engine](events)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "events": args.single_events,
+        "engine": args.engine,
+        "seconds": round(elapsed, 3),
+        "events_per_second": round(args.single_events / elapsed),
+        "interactions": len(df),
+        "users": len(user_list),
+        "books": len(book_list),
+        "input_mb": round(events.nbytes / 1e6, 1),
+        "output_mb": round(df.memory_usage(deep=False).sum() / 1e6, 1),
+        "peak_rss_mb": round(max_rss_mb(), 1),
+        "rss_before_mb": round(input_rss, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", default="10000000,100000000", help="comma-separated event counts")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--books", type=int, default=200000)
+    parser.add_argument("--engines", default="vectorized,legacy")
+    parser.add_argument("--legacy-max-events", type=int, default=10000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write all results as a JSON list")
+    parser.add_argument("--single-events", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--engine", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single_events:
+        run_single(args)
+        return
+
+    results = []
+    for num_events in [int(n) for n in args.events.split(",")]:
+        for engine in args.engines.split(","):
+            if engine == "legacy" and num_events > args.legacy_max_events:
+                continue
+            out = subprocess.run(
+                [sys.executable, __file__, "--single-events", str(num_events), "--engine", engine,
+                 "--users", str(args.users), "--books", str(args.books), "--seed", str(args.seed)],
+                capture_output=True, text=True
+            )
+            if out.returncode != 0:
+                result = {"events": num_events, "engine": engine, "error": out.stderr.strip().splitlines()[-1:]}
+            else:
+                result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(json.dumps(result), flush=True)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Throughput and latency benchmark for the recommendation path with local stand-ins.
+
+Supabase, Pinecone and S3 are replaced in-process so the run is reproducible and
+needs no credentials:
+
+- S3: a directory-backed client swapped into factor_store, serving a synthetic
+  factor artifact that the real FactorStore loads (memory-mapped) as in production.
+- Pinecone: a fake `pinecone` module whose indexes return stored user vectors and
+  random catalog matches after a configurable simulated round trip.
+- Supabase: an httpx MockTransport on the shared client answering the users and
+  books REST calls from the synthetic catalog, with a configurable delay.
+
+The endpoint is driven through the ASGI app with real JWTs, so auth, candidate
+generation, merging and metadata lookup all run. Each source function is also
+measured on its own.
+
+    python benchmarks/recommend_bench.py --books 10000,100000,1000000 --output bench.json
+
+Prints one JSON object per (catalog size, target) and optionally writes them all to --output.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import types
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+
+SERVICE_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "recommendation_service")
+BENCH_BUCKET = "bench"
+BENCH_PREFIX = "als"
+SUPABASE_URL = "http://supabase.bench"
+SECRET_KEY = "recommend-bench"
+
+
+class LocalS3:
+    """The subset of the boto3 S3 client used by factor_store, backed by a local directory."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self.exceptions.NoSuchKey(Key)
+        with open(path, "rb") as f:
+            return {"Body": BytesIO(f.read())}
+
+    def download_file(self, bucket, key, filename):
+        shutil.copyfile(self._path(bucket, key), filename)
+
+    def put_file(self, bucket, key, local_path):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(local_path, path)
+
+
+class Catalog:
+    """Synthetic users and books shared by all stand-ins."""
+
+    def __init__(self, num_users, num_books, factors, embedding_dim, seed):
+        rng = np.random.default_rng(seed)
+        self.user_ids = np.array([f"u{i:07d}" for i in range(num_users)])
+        self.book_ids = np.array([f"b{i:08d}" for i in range(num_books)])
+        self.user_factors = rng.normal(size=(num_users, factors)).astype(np.float32)
+        book_factors = rng.normal(size=(num_books, factors)) * rng.lognormal(sigma=0.5, size=(num_books, 1))
+        self.book_factors = book_factors.astype(np.float32)
+        self.user_embeddings = rng.normal(size=(num_users, embedding_dim)).astype(np.float32)
+
+    def username(self, row):
+        return f"reader{row}"
+
+    def user_row(self, username):
+        return int(username[len("reader"):])
+
+    def book(self, book_id):
+        return {
+            "id": book_id,
+            "title": f"Title {book_id}",
+            "authors": ["Synthetic Author"],
+            "categories": ["Fiction"],
+            "thumbnail_url": None,
+            "download_link": None,
+        }
+
+
+class _Bench:
+    catalog = None
+    pinecone_latency = 0.0
+    supabase_latency = 0.0
+
+
+class _FakeIndex:
+    def __init__(self, name):
+        self.name = name
+
+    def fetch(self, ids, namespace=None):
+        time.sleep(_Bench.pinecone_latency)
+        catalog = _Bench.catalog
+        vectors = {}
+        for user_id in ids:
+            row = int(user_id[1:]) if user_id[1:].isdigit() else -1
+            if 0 <= row < len(catalog.user_ids):
+                vectors[user_id] = types.SimpleNamespace(values=catalog.user_embeddings[row].tolist())
+        return types.SimpleNamespace(vectors=vectors)
+
+    def query(self, vector, top_k, namespace=None):
+        time.sleep(_Bench.pinecone_latency)
+        catalog = _Bench.catalog
+        rows = np.random.default_rng().choice(len(catalog.book_ids), top_k, replace=False)
+        scores = np.sort(np.random.default_rng().random(top_k))[::-1]
+        matches = [{"id": catalog.book_ids[r], "score": float(s)} for r, s in zip(rows, scores)]
+        return types.SimpleNamespace(matches=matches)
+
+
+class _FakePinecone:
+    def __init__(self, api_key=None):
+        pass
+
+    def Index(self, name):
+        return _FakeIndex(name)
+
+
+async def _supabase_handler(request):
+    import httpx
+
+    await asyncio.sleep(_Bench.supabase_latency)
+    catalog = _Bench.catalog
+    url = urlparse(str(request.url))
+    params = parse_qs(url.query)
+    if url.path == "/rest/v1/users":
+        username = params["username"][0][len("eq."):]
+        row = catalog.user_row(username)
+        return httpx.Response(200, json=[{"id": catalog.user_ids[row], "username": username}])
+    if url.path == "/rest/v1/books":
+        if "id" in params:
+            ids = params["id"][0][len("in.("):-1].replace('"', "").split(",")
+        else:
+            offset, limit = int(params["offset"][0]), int(params["limit"][0])
+            ids = catalog.book_ids[offset:offset + limit]
+        return httpx.Response(200, json=[catalog.book(str(book_id)) for book_id in ids])
+    return httpx.Response(404, json={})
+
+
+def install_stand_ins(work_dir):
+    """Set the service environment and fake dependencies, then import the service modules."""
+    os.environ.update({
+        "S3_URI": BENCH_BUCKET,
+        "ALS_S3_PREFIX": BENCH_PREFIX,
+        "ALS_FACTOR_CACHE_DIR": os.path.join(work_dir, "factor_cache"),
+        "SUPABASE_URL": SUPABASE_URL,
+        "SUPABASE_SERVICE_ROLE_KEY": "bench",
+        "SECRET_KEY": SECRET_KEY,
+        "PINECONE_API_KEY": "bench",
+        "RECOMMENDATION_LOG_SAMPLE_RATE": "0",
+    })
+    sys.modules["pinecone"] = types.SimpleNamespace(Pinecone=_FakePinecone)
+    sys.path.insert(0, SERVICE_DIR)
+
+    import httpx
+    import factor_store
+    import http_client
+    import main
+
+    factor_store.s3 = LocalS3(os.path.join(work_dir, "s3"))
+    http_client._client = httpx.AsyncClient(transport=httpx.MockTransport(_supabase_handler))
+    return main
+
+
+def publish_factors(s3, work_dir, catalog, version):
+    """Write the catalog as a factor artifact in the layout the training job uploads."""
+    local_dir = os.path.join(work_dir, "artifact", version)
+    os.makedirs(local_dir, exist_ok=True)
+    files = {name: f"{name}.npy" for name in ("user_ids", "user_factors", "book_ids", "book_factors")}
+    np.save(os.path.join(local_dir, files["user_ids"]), catalog.user_ids)
+    np.save(os.path.join(local_dir, files["user_factors"]), catalog.user_factors)
+    np.save(os.path.join(local_dir, files["book_ids"]), catalog.book_ids)
+    np.save(os.path.join(local_dir, files["book_factors"]), catalog.book_factors)
+    manifest = {
+        "format_version": 1,
+        "version": version,
+        "num_users": len(catalog.user_ids),
+        "num_books": len(catalog.book_ids),
+        "factors": catalog.book_factors.shape[1],
+        "dtype": "float32",
+        "files": files,
+    }
+    for file_name in files.values():
+        s3.put_file(BENCH_BUCKET, f"{BENCH_PREFIX}/factors/{version}/{file_name}", os.path.join(local_dir, file_name))
+    manifest_path = os.path.join(local_dir, "manifest.json")
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+    s3.put_file(BENCH_BUCKET, f"{BENCH_PREFIX}/factors/manifest.json", manifest_path)
+    shutil.rmtree(local_dir)
+
+
+def summarize(samples, errors, elapsed):
+    latencies = np.asarray(samples) * 1000
+    result = {
+        "requests": len(samples) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+    }
+    if len(latencies):
+        result.update({f"p{p}_ms": round(float(np.percentile(latencies, p)), 3) for p in (50, 95, 99)})
+    return result
+
+
+async def drive(call, num_requests, concurrency, num_users, seed):
+    """Issue num_requests calls for random users from `concurrency` workers."""
+    rng = random.Random(seed)
+    users = [rng.randrange(num_users) for _ in range(num_requests)]
+    samples, errors = [], 0
+    position = 0
+
+    async def worker():
+        nonlocal position, errors
+        while position < len(users):
+            row = users[position]
+            position += 1
+            started = time.perf_counter()
+            try:
+                await call(row)
+            except Exception:
+                errors += 1
+                continue
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(samples, errors, time.perf_counter() - started)
+
+
+async def bench_catalog(service, args, num_books, work_dir):
+    import httpx
+    import jwt
+    import factor_store
+    import collaborative_filtering as cf
+    import content_based_recommendation as cbr
+    from book_cache import BookMetadataCache
+
+    catalog = Catalog(args.users, num_books, args.factors, args.embedding_dim, args.seed)
+    _Bench.catalog = catalog
+    publish_factors(factor_store.s3, work_dir, catalog, f"bench-{num_books}")
+
+    started = time.perf_counter()
+    await factor_store.store.refresh()
+    load_seconds = time.perf_counter() - started
+
+    # Fresh per-catalog caches, warmed the way the app lifespan does it
+    service.book_cache = BookMetadataCache()
+    started = time.perf_counter()
+    await service.book_cache.warm(service.fetch_all_books)
+    warm_seconds = time.perf_counter() - started
+    if not args.recommendation_cache:
+        service.recommendation_cache.max_size = 0
+
+    tokens = {}
+
+    def token_for(row):
+        if row not in tokens:
+            payload = {"sub": catalog.username(row), "exp": int(time.time()) + 3600}
+            tokens[row] = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+        return tokens[row]
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=service.app), base_url="http://bench") as api:
+        async def endpoint(row):
+            resp = await api.get("/api/v1/recommend/combined",
+                                 headers={"Authorization": f"Bearer {token_for(row)}"})
+            resp.raise_for_status()
+
+        targets = {
+            "source_als": lambda row: cf.recommend_als_books(catalog.user_ids[row], 50),
+            "source_content_based": lambda row: cbr.dense_vector_recommendation(catalog.user_ids[row], 50),
+            "recommend_combined": endpoint,
+        }
+        results = []
+        for name, call in targets.items():
+            await drive(call, min(args.warmup, args.requests), args.concurrency, args.users, args.seed + 1)
+            result = {
+                "books": num_books,
+                "target": name,
+                "factor_load_s": round(load_seconds, 3),
+                "book_cache_warm_s": round(warm_seconds, 3),
+            }
+            result.update(await drive(call, args.requests, args.concurrency, args.users, args.seed))
+            print(json.dumps(result), flush=True)
+            results.append(result)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__) or ".",
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    work_dir = tempfile.mkdtemp(prefix="recommend-bench-")
+    try:
+        service = install_stand_ins(work_dir)
+        results = []
+        for num_books in [int(n) for n in args.books.split(",")]:
+            results.extend(await bench_catalog(service, args, num_books, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", default="10000,100000,1000000", help="comma-separated catalog sizes")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--embedding-dim", type=int, default=384)
+    parser.add_argument("--requests", type=int, default=2000, help="measured requests per target")
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=10.0, help="simulated Pinecone round trip")
+    parser.add_argument("--supabase-latency-ms", type=float, default=5.0, help="simulated Supabase round trip")
+    parser.add_argument("--recommendation-cache", action="store_true",
+                        help="keep the per-user recommendation cache on (off by default so every request computes)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write all results as a JSON document")
+    args = parser.parse_args()
+
+    _Bench.pinecone_latency = args.pinecone_latency_ms / 1000
+    _Bench.supabase_latency = args.supabase_latency_ms / 1000
+    random.seed(args.seed)
+
+    results = asyncio.run(run(args))
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "config": vars(args),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,19 @@ import numpy as np
 import ray
 import boto3
 import pickle
+import json
+import time
+import itertools
+import requests
+from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.compute as pc
 from implicit.als import AlternatingLeastSquares
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from ray.data.aggregate import Max, Sum
 import scipy.sparse as sp
+from preprocessing import EVENT_WEIGHTS, VALID_EVENT_TYPES, build_interactions, event_weights
 
 logging.basicConfig(level=logging.INFO)
 ray.init(address="auto", ignore_reinit_error=True)
@@ -25,52 +34,503 @@ def get_s3_client():
         aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
     )
 
+EVENT_FIELDS = ["user_id", "item_id", "event_type", "received_at"]
+EVENT_SCHEMA = pa.schema([
+    ("user_id", pa.string()),
+    ("item_id", pa.string()),
+    ("event_type", pa.dictionary(pa.int8(), pa.string())),
+    ("received_at", pa.timestamp("ms")),
+])
+
+
+def event_batch(columns):
+    return pa.RecordBatch.from_arrays([
+        pa.array([str(v) for v in columns["user_id"]], type=pa.string()),
+        pa.array([str(v) for v in columns["item_id"]], type=pa.string()),
+        pa.array(columns["event_type"], type=pa.string()).dictionary_encode().cast(EVENT_SCHEMA.field("event_type").type),
+        pa.array(columns["received_at"], type=pa.timestamp("ms")),
+    ], schema=EVENT_SCHEMA)
+
+
+AGGREGATED_SCHEMA = pa.schema([
+    ("user_id", pa.string()),
+    ("item_id", pa.string()),
+    ("weight", pa.float32()),
+    ("received_at", pa.timestamp("ms")),
+])
+
+
+def event_query(window_days, since=None):
+    query = {"item_id": {"$ne": None}, "event_type": {"$in": VALID_EVENT_TYPES}}
+    if since is not None:
+        query["received_at"] = {"$gt": since}
+    elif window_days > 0:
+        query["received_at"] = {"$gte": datetime.utcnow() - timedelta(days=window_days)}
+    return query
+
+
+def aggregation_pipeline(window_days, half_life_days, since=None):
+    """
+    $match valid events, weight each by event type (optionally decayed by age with
+    the given half-life), and $group to one (user, book) row with the summed weight
+    and the newest event time.
+    """
+    weight = {"$switch": {
+        "branches": [{"case": {"$eq": ["$event_type", t]}, "then": w} for t, w in EVENT_WEIGHTS.items()],
+        "default": 1.0,
+    }}
+    if half_life_days > 0:
+        # 0.5 ** (age / half_life), with the age in milliseconds
+        decay_per_ms = -float(np.log(2)) / (half_life_days * 86400 * 1000)
+        weight = {"$multiply": [weight, {"$exp": {
+            "$multiply": [decay_per_ms, {"$subtract": ["$$NOW", "$received_at"]}]
+        }}]}
+    return [
+        {"$match": event_query(window_days, since)},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "item_id": "$item_id"},
+            "weight": {"$sum": weight},
+            "received_at": {"$max": "$received_at"},
+        }},
+    ]
+
+
+def aggregated_batch(docs):
+    return pa.RecordBatch.from_arrays([
+        pa.array([str(d["_id"]["user_id"]) for d in docs], type=pa.string()),
+        pa.array([str(d["_id"]["item_id"]) for d in docs], type=pa.string()),
+        pa.array([d["weight"] for d in docs], type=pa.float32()),
+        pa.array([d.get("received_at") for d in docs], type=pa.timestamp("ms")),
+    ], schema=AGGREGATED_SCHEMA)
+
+
 @ray.remote
-def load_events():
+def load_aggregated_events(since=None):
+    """
+    Let MongoDB compute the interaction weights: only one (user_id, item_id, weight,
+    received_at) row per pair crosses the wire, streamed into Arrow batches.
+    received_at is the pair's newest event, which is all incremental mode needs.
+    """
     mongo_uri = os.environ["MONGO_URI"]
     client = MongoClient(mongo_uri, server_api=ServerApi("1"), serverSelectionTimeoutMS=5000)
+    batch_size = int(os.environ.get("MONGO_BATCH_SIZE", 50000))
+    pipeline = aggregation_pipeline(
+        float(os.environ.get("ALS_EVENT_WINDOW_DAYS", 0)),
+        float(os.environ.get("ALS_DECAY_HALF_LIFE_DAYS", 0)),
+        since
+    )
+    cursor = client["click_stream"]["events"].aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+
+    batches = []
+    docs = []
+    for doc in cursor:
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            batches.append(aggregated_batch(docs))
+            docs = []
+    if docs:
+        batches.append(aggregated_batch(docs))
+    client.close()
+
+    events = pa.Table.from_batches(batches, schema=AGGREGATED_SCHEMA)
+    logging.info(f"Loaded {events.num_rows} aggregated interactions in {len(batches)} batches")
+    return events
 
-    df = pd.DataFrame(list(client["click_stream"]["events"].find()))
-    df = df[df["item_id"].notna()]
-    return df
 
 @ray.remote
-def preprocess(df):
-    valid_event_types = ["read", "page_turn", "review", "bookmark_add"]
-    df = df[df["event_type"].isin(valid_event_types)]
+def load_events(since=None):
+    """
+    Stream the training events into an Arrow table. Only the four fields training
+    uses are projected, event types and the optional ALS_EVENT_WINDOW_DAYS window
+    are filtered on the server, and documents are drained batch by batch into
+    columnar record batches, so no more than one batch of dicts is ever alive.
+    """
+    mongo_uri = os.environ["MONGO_URI"]
+    client = MongoClient(mongo_uri, server_api=ServerApi("1"), serverSelectionTimeoutMS=5000)
+    batch_size = int(os.environ.get("MONGO_BATCH_SIZE", 50000))
+    window_days = float(os.environ.get("ALS_EVENT_WINDOW_DAYS", 0))
 
-    df["weight"] = df["event_type"].map(
-        lambda x: 3.0 if x == "review" else 2.0 if x == "read" else 1.0
-    )
-    df.rename(columns={"item_id": "book_id"}, inplace=True)
+    query = event_query(window_days, since)
+    projection = {"_id": 0, **{field: 1 for field in EVENT_FIELDS}}
+    cursor = client["click_stream"]["events"].find(query, projection, batch_size=batch_size)
+
+    batches = []
+    columns = {field: [] for field in EVENT_FIELDS}
+    for doc in cursor:
+        for field in EVENT_FIELDS:
+            columns[field].append(doc.get(field))
+        if len(columns["user_id"]) >= batch_size:
+            batches.append(event_batch(columns))
+            columns = {field: [] for field in EVENT_FIELDS}
+    if columns["user_id"]:
+        batches.append(event_batch(columns))
+    client.close()
 
-    df = df.groupby(["user_id", "book_id"], as_index=False)["weight"].sum()
+    events = pa.Table.from_batches(batches, schema=EVENT_SCHEMA)
+    logging.info(f"Loaded {events.num_rows} events ({events.nbytes / 1e6:.1f} MB) in {len(batches)} batches")
+    return events
+
+def datetime_to_ms(value):
+    return int(pd.Timestamp(value).value // 1_000_000)
+
+
+def ms_to_datetime(ms):
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(ms))
+
+
+def event_time_range(client, window_days, since=None):
+    """Oldest and newest received_at among the events this run loads, or None if there are none."""
+    query = event_query(window_days, since)
+    query["received_at"] = {**query.get("received_at", {}), "$ne": None}
+    bounds = [
+        client["click_stream"]["events"].find_one(query, {"_id": 0, "received_at": 1}, sort=[("received_at", order)])
+        for order in (1, -1)
+    ]
+    if bounds[0] is None:
+        return None
+    return bounds[0]["received_at"], bounds[1]["received_at"]
+
+
+def time_partitions(start, end, num_partitions):
+    """Split [start, end] into contiguous, half-open epoch-ms ranges covering both ends."""
+    edges = np.unique(np.linspace(datetime_to_ms(start), datetime_to_ms(end) + 1, num_partitions + 1).astype(np.int64))
+    return [{"start_ms": int(lo), "end_ms": int(hi)} for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+def weighted_block(batch, half_life_days, now_ms):
+    """Raw event batch -> (user_id, item_id, weight, received_at as epoch ms), weighted like the aggregation pipeline."""
+    weights = event_weights(batch.column("event_type"))
+    received = batch.column("received_at").cast(pa.int64())
+    if half_life_days > 0:
+        age = now_ms - received.to_numpy(zero_copy_only=False)
+        # Undated events decay to nothing, as $sum skips them in MongoDB
+        decay = np.nan_to_num(np.exp(-np.log(2) * age / (half_life_days * 86400 * 1000)), nan=0.0)
+        weights = (weights * decay).astype(np.float32)
+    return pa.table({
+        "user_id": batch.column("user_id"),
+        "item_id": batch.column("item_id"),
+        "weight": pa.array(weights, type=pa.float32()),
+        "received_at": received,
+    })
+
+
+def read_event_ranges(ranges, half_life_days, now_ms):
+    """
+    map_batches UDF run in parallel read tasks: stream the events of each time range
+    from MongoDB and yield one weighted Arrow block per cursor batch.
+    """
+    client = MongoClient(os.environ["MONGO_URI"], server_api=ServerApi("1"), serverSelectionTimeoutMS=5000)
+    batch_size = int(os.environ.get("MONGO_BATCH_SIZE", 50000))
+    projection = {"_id": 0, **{field: 1 for field in EVENT_FIELDS}}
+    try:
+        for start_ms, end_ms, include_undated in zip(
+            ranges["start_ms"].to_pylist(), ranges["end_ms"].to_pylist(), ranges["include_undated"].to_pylist()
+        ):
+            query = event_query(0)
+            window = {"$gte": ms_to_datetime(start_ms), "$lt": ms_to_datetime(end_ms)}
+            if include_undated:
+                query["$or"] = [{"received_at": window}, {"received_at": None}]
+            else:
+                query["received_at"] = window
+            cursor = client["click_stream"]["events"].find(query, projection, batch_size=batch_size)
+
+            columns = {field: [] for field in EVENT_FIELDS}
+            for doc in cursor:
+                for field in EVENT_FIELDS:
+                    columns[field].append(doc.get(field))
+                if len(columns["user_id"]) >= batch_size:
+                    yield weighted_block(event_batch(columns), half_life_days, now_ms)
+                    columns = {field: [] for field in EVENT_FIELDS}
+            if columns["user_id"]:
+                yield weighted_block(event_batch(columns), half_life_days, now_ms)
+    finally:
+        client.close()
+
+
+def interaction_block(table):
+    return table.rename_columns(AGGREGATED_SCHEMA.names).cast(AGGREGATED_SCHEMA)
+
+
+def interaction_dataset(since=None):
+    """
+    The training interactions as a partitioned Ray Dataset with the aggregate loader's
+    schema, one row per (user, book). The event time span is cut into
+    ALS_READ_PARALLELISM ranges that are read from MongoDB by parallel tasks,
+    weighted block by block and summed with a distributed groupby, so raw events
+    only ever exist as Arrow blocks in the object store. Returns None without events.
+    """
+    window_days = float(os.environ.get("ALS_EVENT_WINDOW_DAYS", 0))
+    client = MongoClient(os.environ["MONGO_URI"], server_api=ServerApi("1"), serverSelectionTimeoutMS=5000)
+    bounds = event_time_range(client, window_days, since)
+    client.close()
+    if bounds is None:
+        return None
+
+    ranges = time_partitions(*bounds, int(os.environ.get("ALS_READ_PARALLELISM", 8)))
+    # Events without a timestamp only match an unbounded query; the first range picks them up
+    for i, time_range in enumerate(ranges):
+        time_range["include_undated"] = i == 0 and since is None and window_days == 0
+    logging.info(f"Reading events from {bounds[0]} to {bounds[1]} in {len(ranges)} partitions")
+
+    return (
+        ray.data.from_items(ranges, override_num_blocks=len(ranges))
+        .map_batches(
+            read_event_ranges, batch_size=1, batch_format="pyarrow",
+            fn_kwargs={
+                "half_life_days": float(os.environ.get("ALS_DECAY_HALF_LIFE_DAYS", 0)),
+                "now_ms": datetime_to_ms(datetime.utcnow()),
+            }
+        )
+        .groupby(["user_id", "item_id"])
+        .aggregate(Sum("weight"), Max("received_at"))
+        .map_batches(interaction_block, batch_format="pyarrow")
+    )
 
-    user_list = df["user_id"].unique().tolist()
-    book_list = df["book_id"].unique().tolist()
 
-    user_map = {u: i for i, u in enumerate(user_list)}
-    book_map = {b: i for i, b in enumerate(book_list)}
+@ray.remote(num_returns=4)
+def collect_interactions(dataset, since=None):
+    """
+    Pull the aggregated blocks into the (user_idx, book_idx, weight) frame training
+    consumes; this is the only point the interaction matrix is materialized. The
+    fourth return carries events_until and the users and books changed since `since`.
+    """
+    blocks = [] if dataset is None else list(dataset.iter_batches(batch_size=None, batch_format="pyarrow"))
+    interactions = pa.concat_tables(blocks) if blocks else AGGREGATED_SCHEMA.empty_table()
+    df, user_list, book_list = build_interactions(interactions)
+    changed_users, changed_books = changed_since(interactions, since) if since is not None else (set(), set())
+    logging.info(f"Collected {len(df)} interactions between {len(user_list)} users and {len(book_list)} books "
+                 f"from {len(blocks)} blocks")
+    summary = {
+        "events_until": pc.max(interactions["received_at"]).as_py() if interactions.num_rows else None,
+        "changed_users": changed_users,
+        "changed_books": changed_books,
+    }
+    return df, user_list, book_list, summary
 
-    df["user_idx"] = df["user_id"].map(user_map)
-    df["book_idx"] = df["book_id"].map(book_map)
 
+@ray.remote(num_returns=3)
+def preprocess(events):
+    df, user_list, book_list = build_interactions(events)
+    logging.info(f"Preprocessed {events.num_rows} events into {len(df)} interactions "
+                 f"between {len(user_list)} users and {len(book_list)} books")
     return df, user_list, book_list
 
+def fetch_published(s3, name, keys, local_dir):
+    """
+    Download the given files of the latest version published under s3_uri/name/
+    (manifest.json pointing at a versioned directory). Returns (manifest, local
+    paths by key), or None when nothing has been published yet.
+    """
+    bucket = s3_uri.split("/")[2]
+    prefix = "/".join(s3_uri.split("/")[3:]) + f"{name}/"
+    try:
+        s3_obj = s3.get_object(Bucket=bucket, Key=prefix + "manifest.json")
+    except s3.exceptions.NoSuchKey:
+        return None
+    manifest = json.loads(s3_obj["Body"].read())
+
+    os.makedirs(local_dir, exist_ok=True)
+    paths = {}
+    for key in keys:
+        file_name = manifest["files"][key]
+        paths[key] = os.path.join(local_dir, file_name)
+        s3.download_file(bucket, f"{prefix}{manifest['version']}/{file_name}", paths[key])
+    logging.info(f"Loaded previous {name} version {manifest['version']}")
+    return manifest, paths
+
+
+def load_previous_factors(s3, local_dir="previous_factors"):
+    """
+    The last published factor artifact as (manifest, arrays), or None when
+    nothing has been published yet.
+    """
+    fetched = fetch_published(s3, "factors", ("user_ids", "user_factors", "book_ids", "book_factors"), local_dir)
+    if fetched is None:
+        return None
+    manifest, paths = fetched
+    return manifest, {key: np.load(path) for key, path in paths.items()}
+
+
+def load_interaction_snapshot(s3, local_dir="previous_interactions"):
+    """
+    The persisted interaction matrix as (manifest, csr, user_ids, book_ids), or
+    None when there is none yet. Row/column i of the matrix is user_ids[i]/book_ids[i].
+    """
+    fetched = fetch_published(s3, "interactions", ("matrix", "user_ids", "book_ids"), local_dir)
+    if fetched is None:
+        return None
+    manifest, paths = fetched
+    return manifest, sp.load_npz(paths["matrix"]).tocsr(), np.load(paths["user_ids"]), np.load(paths["book_ids"])
+
+
+def save_interaction_snapshot(out_dir, version, matrix, user_ids, book_ids, events_until):
+    os.makedirs(out_dir, exist_ok=True)
+    files = {"matrix": "interactions.npz", "user_ids": "user_ids.npy", "book_ids": "book_ids.npy"}
+    sp.save_npz(os.path.join(out_dir, files["matrix"]), matrix)
+    np.save(os.path.join(out_dir, files["user_ids"]), user_ids)
+    np.save(os.path.join(out_dir, files["book_ids"]), book_ids)
+    manifest = {
+        "version": version,
+        "created_at": datetime.utcnow().isoformat(),
+        "events_until": events_until,
+        "num_users": len(user_ids),
+        "num_books": len(book_ids),
+        "nnz": int(matrix.nnz),
+        "files": files,
+    }
+    save_manifest(out_dir, manifest)
+    return manifest
+
+
+def extend_ids(ids, new_ids):
+    """
+    Stable index of each of new_ids in ids, appending unknown ids at the end so
+    existing indices never move. new_ids must be unique. Returns (ids, index).
+    """
+    ids = np.asarray(ids, dtype=str)
+    new_ids = np.asarray([str(i) for i in new_ids], dtype=str)
+    index = np.empty(len(new_ids), dtype=np.int64)
+    known = np.zeros(len(new_ids), dtype=bool)
+    if len(ids):
+        order = np.argsort(ids, kind="stable")
+        pos = np.minimum(np.searchsorted(ids[order], new_ids), len(ids) - 1)
+        known = ids[order][pos] == new_ids
+        index[known] = order[pos[known]]
+    index[~known] = len(ids) + np.arange(int((~known).sum()))
+    return np.concatenate([ids, new_ids[~known]]), index
+
+
+def merge_interactions(matrix, user_ids, book_ids, df, user_list, book_list):
+    """
+    Add newly preprocessed (user_idx, book_idx, weight) rows onto the persisted
+    matrix. Work is proportional to the new rows plus one sparse add.
+    """
+    user_ids, user_index = extend_ids(user_ids, user_list)
+    book_ids, book_index = extend_ids(book_ids, book_list)
+    delta = sp.csr_matrix(
+        (df["weight"].to_numpy(dtype=np.float32),
+         (user_index[df["user_idx"].to_numpy(dtype=np.int64)], book_index[df["book_idx"].to_numpy(dtype=np.int64)])),
+        shape=(len(user_ids), len(book_ids))
+    )
+    matrix = matrix.copy()
+    matrix.resize((len(user_ids), len(book_ids)))
+    return (matrix + delta).tocsr(), user_ids, book_ids
+
+
+def interactions_frame(matrix):
+    """The (user_idx, book_idx, weight) frame the training stages consume."""
+    coo = matrix.tocoo()
+    return pd.DataFrame({"user_idx": coo.row, "book_idx": coo.col, "weight": coo.data})
+
+
+@ray.remote(num_returns=6)
+def merge_snapshot(snapshot, df, user_list, book_list):
+    """
+    Merge the new interactions onto the persisted snapshot (or an empty one).
+    Returns the merged (df, user_list, book_list) for training followed by the
+    matrix and id tables the next snapshot is saved from.
+    """
+    if snapshot is None:
+        matrix, user_ids, book_ids = sp.csr_matrix((0, 0), dtype=np.float32), np.empty(0, dtype=str), np.empty(0, dtype=str)
+    else:
+        _, matrix, user_ids, book_ids = snapshot
+    matrix, user_ids, book_ids = merge_interactions(matrix, user_ids, book_ids, df, user_list, book_list)
+    logging.info(f"Merged {len(df)} new interactions into a {matrix.shape} matrix with {matrix.nnz} entries")
+    return interactions_frame(matrix), user_ids.tolist(), book_ids.tolist(), matrix, user_ids, book_ids
+
+
+save_interaction_snapshot_task = ray.remote(save_interaction_snapshot)
+
+
+def changed_since(events, since):
+    """User and book ids with events received after `since`."""
+    since = pa.scalar(pd.Timestamp(since).to_pydatetime(), type=events.schema.field("received_at").type)
+    recent = events.filter(pc.greater(events["received_at"], since))
+    return set(recent["user_id"].to_pylist()), set(recent["item_id"].to_pylist())
+
+
+def warm_start_factors(ids, previous_ids, previous_factors, rng):
+    """
+    Initial factor rows for ids: the previous row for ids the last model knew,
+    implicit's small random init for new ones. Also returns the known-id mask.
+    """
+    ids = np.asarray([str(i) for i in ids])
+    factors = rng.random((len(ids), previous_factors.shape[1]), dtype=np.float32) * 0.01
+    if len(previous_ids) == 0:
+        return factors, np.zeros(len(ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(previous_ids, ids), len(previous_ids) - 1)
+    known = previous_ids[pos] == ids
+    factors[known] = previous_factors[pos[known]]
+    return factors, known
+
+
+def fit_incremental(model, mat, user_list, book_list, previous, changed_users, changed_books, iterations):
+    """
+    Continue from the previous model instead of a random start. New users and books,
+    and those with events since the last run, are re-solved against the other side's
+    fixed factors (implicit's partial_fit_users/partial_fit_items, the same solve as
+    recalculate_user), which costs in proportion to the day's changes. `iterations`
+    full ALS sweeps then let everything settle; 0 keeps it a pure fold-in.
+    """
+    rng = np.random.default_rng()
+    model.user_factors, known_users = warm_start_factors(
+        user_list, previous["user_ids"], previous["user_factors"], rng)
+    model.item_factors, known_books = warm_start_factors(
+        book_list, previous["book_ids"], previous["book_factors"], rng)
+
+    user_ids = np.asarray([str(u) for u in user_list])
+    book_ids = np.asarray([str(b) for b in book_list])
+    user_rows = np.flatnonzero(~known_users | np.isin(user_ids, list(changed_users)))
+    book_rows = np.flatnonzero(~known_books | np.isin(book_ids, list(changed_books)))
+    if len(user_rows):
+        model.partial_fit_users(user_rows, mat[user_rows])
+    if len(book_rows):
+        model.partial_fit_items(book_rows, mat.T.tocsr()[book_rows])
+    logging.info(f"Folded in {len(user_rows)} users and {len(book_rows)} books")
+
+    if iterations > 0:
+        # fit() keeps factors that are already set, so this continues from the warm start
+        model.iterations = iterations
+        model.fit(mat)
+
+
+def als_config(overrides=None):
+    """ALS hyperparameters from the ALS_* env vars, with optional per-run overrides (e.g. a sweep winner)."""
+    config = {
+        "factors": int(os.environ.get("ALS_FACTORS", 64)),
+        "regularization": float(os.environ.get("ALS_REG", 0.1)),
+        "iterations": int(os.environ.get("ALS_ITER", 20)),
+        "alpha": float(os.environ.get("ALS_ALPHA", 40.0)),
+    }
+    config.update(overrides or {})
+    return config
+
+
 @ray.remote
-def train_als(df, user_list, book_list):
-    mat = sp.coo_matrix(
+def train_als(df, user_list, book_list, previous=None, changed_users=(), changed_books=(), config=None):
+    config = als_config(config)
+    mat = (sp.coo_matrix(
         (df["weight"], (df["user_idx"], df["book_idx"])),
         shape=(len(user_list), len(book_list))
-    ) * float(os.environ.get("ALS_ALPHA", 40.0))
+    ) * config["alpha"]).tocsr().astype(np.float32)
 
+    factors = config["factors"]
     model = AlternatingLeastSquares(
-        factors=int(os.environ.get("ALS_FACTORS", 64)),
-        regularization=float(os.environ.get("ALS_REG", 0.1)),
-        iterations=int(os.environ.get("ALS_ITER", 20)),
+        factors=factors,
+        regularization=config["regularization"],
+        iterations=config["iterations"],
         calculate_training_loss=True
     )
-    model.fit(mat)
+    if previous is not None and previous["user_factors"].shape[1] != factors:
+        logging.warning("Previous factors have a different rank; training from scratch")
+        previous = None
+    if previous is None:
+        model.fit(mat)
+    else:
+        fit_incremental(
+            model, mat, user_list, book_list, previous, changed_users, changed_books,
+            iterations=int(os.environ.get("ALS_INCREMENTAL_ITER", 2))
+        )
 
     user_factors = pd.DataFrame(model.user_factors)
     user_factors["user_id"] = user_list
@@ -78,13 +538,535 @@ def train_als(df, user_list, book_list):
     book_factors = pd.DataFrame(model.item_factors)
     book_factors["book_id"] = book_list
 
-    return model, user_factors, book_factors
+    # The mode actually used: a rank change falls back to a full fit
+    return model, user_factors, book_factors, "full" if previous is None else "incremental"
+
+
+def sweep_grid():
+    """
+    Candidate configs: the cartesian product of the comma-separated ALS_SWEEP_FACTORS,
+    ALS_SWEEP_REG, ALS_SWEEP_ITER and ALS_SWEEP_ALPHA lists, each defaulting to the
+    single value train_als would use.
+    """
+    base = als_config()
+    axes = {
+        "factors": (os.environ.get("ALS_SWEEP_FACTORS"), int),
+        "regularization": (os.environ.get("ALS_SWEEP_REG"), float),
+        "iterations": (os.environ.get("ALS_SWEEP_ITER"), int),
+        "alpha": (os.environ.get("ALS_SWEEP_ALPHA"), float),
+    }
+    values = {
+        name: [cast(v) for v in raw.split(",") if v.strip()] if raw else [base[name]]
+        for name, (raw, cast) in axes.items()
+    }
+    return [dict(zip(values, combo)) for combo in itertools.product(*values.values())]
+
+
+@ray.remote(num_returns=3)
+def holdout_split(events, holdout_days):
+    """
+    Time-based holdout: interactions received in the last holdout_days of the data
+    are the test set, everything earlier trains. Accepts the raw or aggregated event
+    table, or the aggregated Dataset (where a pair's time is its newest event).
+    Returns (train, test, evaluable users): CSR matrices over the training users and
+    books, where test pairs for unseen users or books, or already in train, are
+    dropped since the service can never recommend them.
+    """
+    if not isinstance(events, pa.Table):
+        blocks = [] if events is None else list(events.iter_batches(batch_size=None, batch_format="pyarrow"))
+        events = pa.concat_tables(blocks) if blocks else AGGREGATED_SCHEMA.empty_table()
+    newest = pc.max(events["received_at"]).as_py()
+    if newest is None:
+        empty = sp.csr_matrix((0, 0), dtype=np.float32)
+        return empty, empty, 0
+    cutoff = pa.scalar(newest - timedelta(days=holdout_days), type=events.schema.field("received_at").type)
+    is_test = pc.fill_null(pc.greater_equal(events["received_at"], cutoff), False)
+
+    df, user_list, book_list = build_interactions(events.filter(pc.invert(is_test)))
+    train = sp.csr_matrix(
+        (df["weight"].to_numpy(), (df["user_idx"].to_numpy(), df["book_idx"].to_numpy())),
+        shape=(len(user_list), len(book_list)), dtype=np.float32
+    )
+
+    held_out = events.filter(is_test)
+    users = pc.index_in(held_out["user_id"], value_set=pa.array(user_list, type=pa.string()))
+    books = pc.index_in(held_out["item_id"], value_set=pa.array(book_list, type=pa.string()))
+    known = pc.and_(pc.is_valid(users), pc.is_valid(books))
+    users = pc.filter(users, known).to_numpy(zero_copy_only=False).astype(np.int64)
+    books = pc.filter(books, known).to_numpy(zero_copy_only=False).astype(np.int64)
+    if len(users) == 0:
+        logging.info(f"Holdout split at {cutoff.as_py()}: no held-out pairs for known users and books")
+        return train, sp.csr_matrix(train.shape, dtype=np.float32), 0
+    fresh = np.asarray(train[users, books]).ravel() == 0
+    test = sp.csr_matrix(
+        (np.ones(int(fresh.sum()), dtype=np.float32), (users[fresh], books[fresh])),
+        shape=train.shape
+    )
+    test.data[:] = 1.0  # duplicate events for a pair sum; relevance is binary
+
+    evaluable = int((np.diff(test.indptr) > 0).sum())
+    logging.info(f"Holdout split at {cutoff.as_py()}: {train.nnz} train and {test.nnz} test interactions, "
+                 f"{evaluable} evaluable users")
+    return train, test, evaluable
+
+
+def ranking_metrics(user_factors, book_factors, train, test, k, block_size=4096):
+    """
+    Mean precision@k, recall@k and NDCG@k (binary relevance) over users with test
+    interactions, ranking every book the user has not interacted with in train,
+    like the service does.
+    """
+    users = np.flatnonzero(np.diff(test.indptr))
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    precision, recall, ndcg = [], [], []
+    for start in range(0, len(users), block_size):
+        rows = users[start:start + block_size]
+        scores = np.asarray(user_factors[rows]) @ np.asarray(book_factors).T
+        seen = train[rows].tocoo()
+        scores[seen.row, seen.col] = -np.inf
+        top = top_n_rows(scores, k)
+        relevant = test[rows].toarray() > 0
+        hits = np.take_along_axis(relevant, top, axis=1)
+        num_relevant = relevant.sum(axis=1)
+        ideal = np.cumsum(discounts)[np.minimum(num_relevant, top.shape[1]) - 1]
+        precision.append(hits.sum(axis=1) / k)
+        recall.append(hits.sum(axis=1) / num_relevant)
+        ndcg.append((hits * discounts[:top.shape[1]]).sum(axis=1) / ideal)
+    if not len(users):
+        return {"precision": 0.0, "recall": 0.0, "ndcg": 0.0, "users": 0}
+    return {
+        "precision": float(np.concatenate(precision).mean()),
+        "recall": float(np.concatenate(recall).mean()),
+        "ndcg": float(np.concatenate(ndcg).mean()),
+        "users": int(len(users)),
+    }
+
+
+@ray.remote
+def evaluate_config(train, test, config, k, num_threads):
+    """Fit one candidate on the shared train matrix and score it on the holdout."""
+    model = AlternatingLeastSquares(
+        factors=config["factors"],
+        regularization=config["regularization"],
+        iterations=config["iterations"],
+        num_threads=num_threads
+    )
+    started = time.perf_counter()
+    model.fit((train * config["alpha"]).astype(np.float32), show_progress=False)
+    train_seconds = time.perf_counter() - started
+    return {
+        **config,
+        **ranking_metrics(model.user_factors, model.item_factors, train, test, k),
+        "train_seconds": round(train_seconds, 3),
+        "factor_mb": round((model.user_factors.nbytes + model.item_factors.nbytes) / 1e6, 3),
+    }
+
+
+def select_config(results, metric, tolerance, min_score):
+    """
+    The fastest config whose metric is within `tolerance` (relative) of the best and
+    at least min_score; the best-scoring config if none reaches min_score.
+    """
+    best = max(results, key=lambda r: r[metric])
+    threshold = max(min_score, best[metric] * (1 - tolerance))
+    qualifying = [r for r in results if r[metric] >= threshold]
+    if not qualifying:
+        logging.warning(f"No config reached {metric}@k >= {min_score}; using the best one")
+        return best
+    return min(qualifying, key=lambda r: (r["train_seconds"], -r[metric]))
+
+
+def run_sweep(events):
+    """
+    Fit every sweep_grid() config in parallel against one holdout split kept in the
+    object store, log the offline metrics and return (selected config, all results).
+    Without a usable holdout the ALS_* defaults are kept and the results are empty.
+    """
+    k = int(os.environ.get("ALS_SWEEP_K", 10))
+    num_threads = int(os.environ.get("ALS_SWEEP_CPUS_PER_TRIAL", 1))
+    train, test, evaluable = holdout_split.remote(events, float(os.environ.get("ALS_SWEEP_HOLDOUT_DAYS", 7)))
+    if ray.get(evaluable) == 0:
+        logging.warning("No evaluable users in the holdout; skipping the sweep")
+        return None, []
+    grid = sweep_grid()
+    results = ray.get([
+        evaluate_config.options(num_cpus=num_threads).remote(train, test, config, k, num_threads)
+        for config in grid
+    ])
+    for r in sorted(results, key=lambda r: -r["ndcg"]):
+        logging.info(
+            f"factors={r['factors']} reg={r['regularization']} iter={r['iterations']} alpha={r['alpha']}: "
+            f"precision@{k}={r['precision']:.4f} recall@{k}={r['recall']:.4f} ndcg@{k}={r['ndcg']:.4f} "
+            f"train={r['train_seconds']:.1f}s factors={r['factor_mb']:.1f}MB"
+        )
+    selected = select_config(
+        results,
+        os.environ.get("ALS_SWEEP_METRIC", "ndcg"),
+        float(os.environ.get("ALS_SWEEP_TOLERANCE", 0.02)),
+        float(os.environ.get("ALS_SWEEP_MIN_SCORE", 0.0))
+    )
+    logging.info(f"Selected {selected} out of {len(grid)} configs")
+    return {name: selected[name] for name in ("factors", "regularization", "iterations", "alpha")}, results
+
+
+def write_factor_artifact(out_dir, version, user_list, user_vecs, book_list, book_vecs):
+    """
+    Write factors as contiguous float32 .npy matrices with id tables sorted by id,
+    so the recommendation service can np.load(mmap_mode="r") them and look ids up
+    with a binary search instead of building a per-process index.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    files = {}
+    for name, ids, vecs in (("user", user_list, user_vecs), ("book", book_list, book_vecs)):
+        ids = np.asarray([str(i) for i in ids])
+        order = np.argsort(ids, kind="stable")
+        sorted_vecs = np.ascontiguousarray(np.asarray(vecs, dtype=np.float32)[order])
+        np.save(os.path.join(out_dir, f"{name}_ids.npy"), ids[order])
+        np.save(os.path.join(out_dir, f"{name}_factors.npy"), sorted_vecs)
+        files[f"{name}_ids"] = f"{name}_ids.npy"
+        files[f"{name}_factors"] = f"{name}_factors.npy"
+
+    manifest = {
+        "format_version": 1,
+        "version": version,
+        "created_at": datetime.utcnow().isoformat(),
+        "num_users": len(user_list),
+        "num_books": len(book_list),
+        "factors": int(np.asarray(book_vecs).shape[1]),
+        "dtype": "float32",
+        "files": files,
+    }
+    save_manifest(out_dir, manifest)
+    return manifest
+
+
+def save_manifest(out_dir, manifest):
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+
+def top_n_rows(scores, n):
+    """Column indices of the n highest scores per row, best first."""
+    n = min(n, scores.shape[1])
+    candidates = np.argpartition(-scores, n - 1, axis=1)[:, :n] if n < scores.shape[1] \
+        else np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def score_user_block(user_vecs, book_vecs, top_n, block_size, seen_indptr=None, seen_indices=None):
+    """
+    Blocked GEMM scoring of users against every book, keeping only each user's top_n.
+    Books in the users' seen CSR (rows aligned with user_vecs) are masked to -inf
+    first, as the service does, so they don't use up the table.
+    """
+    n = min(top_n, book_vecs.shape[0])
+    indices = np.empty((user_vecs.shape[0], n), dtype=np.int32)
+    scores = np.empty((user_vecs.shape[0], n), dtype=np.float16)
+    for start in range(0, user_vecs.shape[0], block_size):
+        block_scores = np.asarray(user_vecs[start:start + block_size]) @ book_vecs.T
+        if seen_indptr is not None:
+            bounds = seen_indptr[start:start + block_scores.shape[0] + 1]
+            rows = np.repeat(np.arange(block_scores.shape[0]), np.diff(bounds))
+            block_scores[rows, seen_indices[bounds[0]:bounds[-1]]] = -np.inf
+        block_indices = top_n_rows(block_scores, n)
+        indices[start:start + block_size] = block_indices
+        scores[start:start + block_size] = np.take_along_axis(block_scores, block_indices, axis=1)
+    return indices, scores
+
+
+score_user_shard = ray.remote(score_user_block)
+
+
+def shard_seen(seen_indptr, seen_indices, start, stop):
+    """The seen CSR of users start..stop, rebased to start at row 0."""
+    if seen_indptr is None:
+        return None, None
+    bounds = seen_indptr[start:stop + 1]
+    return bounds - bounds[0], seen_indices[bounds[0]:bounds[-1]]
+
+
+def precompute_top_n(out_dir, manifest, top_n, block_size=4096, num_shards=1):
+    """
+    Score every user against every book and store each user's top_n as a table
+    aligned with the sorted user id table: book row indices (int32, into the sorted
+    book table) and float16 scores. With num_shards > 1 user shards are scored in
+    parallel Ray tasks sharing one copy of the book factors in the object store.
+    """
+    files = manifest["files"]
+    user_vecs = np.load(os.path.join(out_dir, files["user_factors"]), mmap_mode="r")
+    book_vecs = np.load(os.path.join(out_dir, files["book_factors"]))
+    seen_indptr, seen_indices = None, None
+    if "seen_indptr" in files:
+        seen_indptr = np.load(os.path.join(out_dir, files["seen_indptr"]))
+        seen_indices = np.load(os.path.join(out_dir, files["seen_indices"]))
+
+    if num_shards > 1 and len(user_vecs) > 0:
+        book_ref = ray.put(book_vecs)
+        shards = np.array_split(np.arange(len(user_vecs)), num_shards)
+        results = ray.get([
+            score_user_shard.remote(
+                np.ascontiguousarray(user_vecs[shard]), book_ref, top_n, block_size,
+                *shard_seen(seen_indptr, seen_indices, shard[0], shard[-1] + 1))
+            for shard in shards if len(shard)
+        ])
+        indices = np.concatenate([r[0] for r in results])
+        scores = np.concatenate([r[1] for r in results])
+    else:
+        indices, scores = score_user_block(user_vecs, book_vecs, top_n, block_size, seen_indptr, seen_indices)
+
+    np.save(os.path.join(out_dir, "topn_indices.npy"), indices)
+    np.save(os.path.join(out_dir, "topn_scores.npy"), scores)
+    files["topn_indices"] = "topn_indices.npy"
+    files["topn_scores"] = "topn_scores.npy"
+    manifest["top_n"] = int(indices.shape[1])
+    save_manifest(out_dir, manifest)
+    logging.info(f"Precomputed top-{manifest['top_n']} recommendations for {len(indices)} users")
+    return manifest
+
+
+def normalize_rows(vecs):
+    vecs = np.asarray(vecs, dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vecs / norms
+
+
+def similar_item_block(normed, start, stop, top_m, block_size):
+    """Top-m cosine neighbours of books start..stop against the whole catalog, self excluded."""
+    n = min(top_m, normed.shape[0] - 1)
+    indices = np.empty((stop - start, max(n, 0)), dtype=np.int32)
+    scores = np.empty((stop - start, max(n, 0)), dtype=np.float32)
+    if n <= 0:
+        return indices, scores
+    for block_start in range(start, stop, block_size):
+        block_stop = min(block_start + block_size, stop)
+        block_scores = normed[block_start:block_stop] @ normed.T
+        block_scores[np.arange(block_stop - block_start), np.arange(block_start, block_stop)] = -np.inf
+        block_indices = top_n_rows(block_scores, n)
+        indices[block_start - start:block_stop - start] = block_indices
+        scores[block_start - start:block_stop - start] = np.take_along_axis(block_scores, block_indices, axis=1)
+    return indices, scores
+
+
+similar_item_shard = ray.remote(similar_item_block)
+
+
+def precompute_similar_items(out_dir, manifest, top_m, block_size=4096, num_shards=1, min_score=0.0):
+    """
+    Each book's top_m neighbours by cosine similarity of item factors, stored CSR-style
+    over the sorted book table: neighbours of book row i are
+    similar_indices[similar_indptr[i]:similar_indptr[i + 1]] (int32 book rows, best
+    first) with float16 scores. Neighbours at or below min_score are dropped, so rows
+    can be shorter than top_m.
+    """
+    files = manifest["files"]
+    normed = normalize_rows(np.load(os.path.join(out_dir, files["book_factors"])))
+    num_books = normed.shape[0]
+
+    if num_shards > 1 and num_books > 0:
+        normed_ref = ray.put(normed)
+        bounds = np.linspace(0, num_books, num_shards + 1).astype(int)
+        results = ray.get([
+            similar_item_shard.remote(normed_ref, int(start), int(stop), top_m, block_size)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+        ])
+        indices = np.concatenate([r[0] for r in results])
+        scores = np.concatenate([r[1] for r in results])
+    else:
+        indices, scores = similar_item_block(normed, 0, num_books, top_m, block_size)
+
+    # Scores are sorted per row, so the kept neighbours are a prefix of each row
+    keep = scores > min_score
+    indptr = np.zeros(num_books + 1, dtype=np.int64)
+    np.cumsum(keep.sum(axis=1), out=indptr[1:])
+    np.save(os.path.join(out_dir, "similar_indptr.npy"), indptr)
+    np.save(os.path.join(out_dir, "similar_indices.npy"), indices[keep].astype(np.int32))
+    np.save(os.path.join(out_dir, "similar_scores.npy"), scores[keep].astype(np.float16))
+    files["similar_indptr"] = "similar_indptr.npy"
+    files["similar_indices"] = "similar_indices.npy"
+    files["similar_scores"] = "similar_scores.npy"
+    manifest["similar_top_m"] = int(top_m)
+    save_manifest(out_dir, manifest)
+    logging.info(f"Precomputed {int(indptr[-1])} similar-book neighbours for {num_books} books")
+    return manifest
+
+
+def write_seen_items(out_dir, manifest, df, user_list, book_list):
+    """
+    Books each user has interacted with, stored CSR-style over the sorted user table:
+    seen_indices[seen_indptr[u]:seen_indptr[u + 1]] are sorted int32 rows of the
+    sorted book table. The service masks these before picking top-k.
+    """
+    files = manifest["files"]
+    sorted_users = np.load(os.path.join(out_dir, files["user_ids"]))
+    sorted_books = np.load(os.path.join(out_dir, files["book_ids"]))
+    user_rows = np.searchsorted(sorted_users, np.asarray([str(u) for u in user_list]))
+    book_rows = np.searchsorted(sorted_books, np.asarray([str(b) for b in book_list]))
+
+    users = user_rows[df["user_idx"].to_numpy()]
+    books = book_rows[df["book_idx"].to_numpy()].astype(np.int32)
+    order = np.lexsort((books, users))
+    indptr = np.zeros(len(sorted_users) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(users, minlength=len(sorted_users)), out=indptr[1:])
+
+    np.save(os.path.join(out_dir, "seen_indptr.npy"), indptr)
+    np.save(os.path.join(out_dir, "seen_indices.npy"), books[order])
+    files["seen_indptr"] = "seen_indptr.npy"
+    files["seen_indices"] = "seen_indices.npy"
+    save_manifest(out_dir, manifest)
+    logging.info(f"Stored {len(order)} seen items for {len(sorted_users)} users")
+    return manifest
+
+
+write_seen_items_task = ray.remote(write_seen_items)
+
+
+def load_book_genres(page_size=1000):
+    """Book id -> genres from the Supabase catalog; empty when Supabase isn't configured."""
+    supabase_url = os.environ.get("SUPABASE_URL")
+    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    if not supabase_url or not supabase_key:
+        logging.warning("SUPABASE_URL not set; skipping per-genre popularity")
+        return {}
+    headers = {"apikey": supabase_key, "Authorization": f"Bearer {supabase_key}"}
+    genres = {}
+    offset = 0
+    while True:
+        resp = requests.get(
+            f"{supabase_url}/rest/v1/books",
+            headers=headers,
+            params={"select": "id,categories", "order": "id", "limit": page_size, "offset": offset},
+            timeout=30
+        )
+        resp.raise_for_status()
+        rows = resp.json()
+        for row in rows:
+            genres[str(row["id"])] = row.get("categories") or []
+        if len(rows) < page_size:
+            break
+        offset += page_size
+    return genres
+
+
+def normalize_genre(genre):
+    return str(genre).strip().lower()
+
+
+def precompute_popularity(out_dir, manifest, df, book_list, book_genres, top_n):
+    """
+    Global and per-genre popularity rankings for cold-start users, scored by the
+    summed interaction weights preprocess already aggregated. Rankings hold rows of
+    the sorted book table; per-genre rankings are stored CSR-style over the sorted
+    genre_names table.
+    """
+    files = manifest["files"]
+    sorted_ids = np.load(os.path.join(out_dir, files["book_ids"]))
+    popularity = np.bincount(df["book_idx"], weights=df["weight"], minlength=len(book_list))
+    # Re-index from training order to sorted book table order
+    rows = np.searchsorted(sorted_ids, np.asarray([str(b) for b in book_list]))
+    scores = np.zeros(len(sorted_ids), dtype=np.float32)
+    scores[rows] = popularity
+
+    def ranking(candidate_rows):
+        candidate_rows = np.asarray(candidate_rows, dtype=np.int64)
+        order = np.argsort(-scores[candidate_rows], kind="stable")[:top_n]
+        return candidate_rows[order].astype(np.int32)
+
+    popular_rows = ranking(np.arange(len(sorted_ids)))
+
+    rows_by_genre = {}
+    for row, book_id in enumerate(sorted_ids):
+        for genre in book_genres.get(str(book_id), []):
+            rows_by_genre.setdefault(normalize_genre(genre), []).append(row)
+    genre_names = sorted(rows_by_genre)
+    genre_rankings = [ranking(rows_by_genre[genre]) for genre in genre_names]
+    genre_indptr = np.zeros(len(genre_names) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in genre_rankings], out=genre_indptr[1:])
+    genre_rows = np.concatenate(genre_rankings) if genre_rankings else np.empty(0, dtype=np.int32)
+
+    arrays = {
+        "popular_rows": popular_rows,
+        "popular_scores": scores[popular_rows],
+        "genre_names": np.asarray(genre_names, dtype=str),
+        "genre_indptr": genre_indptr,
+        "genre_rows": genre_rows,
+        "genre_scores": scores[genre_rows],
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), array)
+        files[name] = f"{name}.npy"
+    manifest["popular_top_n"] = int(top_n)
+    save_manifest(out_dir, manifest)
+    logging.info(f"Precomputed top-{top_n} popularity for the catalog and {len(genre_names)} genres")
+    return manifest
+
+
+precompute_popularity_task = ray.remote(precompute_popularity)
 
 
 # === Workflow Execution ===
-df = ray.get(load_events.remote())
-df, user_list, book_list = ray.get(preprocess.remote(df))
-model, user_factors, book_factors = ray.get(train_als.remote(df, user_list, book_list))
+# "aggregate" has MongoDB weight and group the events; "stream" ships raw events;
+# "dataset" reads time ranges in parallel and aggregates them as a partitioned Ray Dataset
+EVENT_LOADER = os.environ.get("ALS_EVENT_LOADER", "stream")
+
+# "incremental" warm-starts from the published model and re-solves what changed since it;
+# "sweep" evaluates a hyperparameter grid on a time-based holdout, then trains the chosen config
+TRAINING_MODE = os.environ.get("ALS_TRAINING_MODE", "full")
+
+# With a persisted interaction matrix only events past its high-water mark are loaded and merged.
+# Decayed or windowed weights change every day, so they always rebuild from the events, and a
+# sweep needs every event's timestamp for its holdout.
+USE_SNAPSHOT = (
+    os.environ.get("ALS_INTERACTION_SNAPSHOT", "false").lower() == "true"
+    and TRAINING_MODE != "sweep"
+    and float(os.environ.get("ALS_DECAY_HALF_LIFE_DAYS", 0)) == 0
+    and float(os.environ.get("ALS_EVENT_WINDOW_DAYS", 0)) == 0
+)
+snapshot = load_interaction_snapshot(get_s3_client()) if USE_SNAPSHOT else None
+snapshot_until = pd.Timestamp(snapshot[0]["events_until"]).to_pydatetime() \
+    if snapshot is not None and snapshot[0]["events_until"] else None
+
+previous, since = None, None
+if TRAINING_MODE == "incremental":
+    loaded = load_previous_factors(get_s3_client())
+    if loaded is None:
+        logging.warning("No published factors to warm-start from; training from scratch")
+    else:
+        previous_manifest, previous = loaded
+        since = previous_manifest.get("events_until") or previous_manifest["created_at"]
+
+# Each step hands the next ObjectRefs, so the interactions go from the object store to the
+# training worker and the artifact writers without ever coming back to the driver. The writers
+# are tasks that write into the driver's artifact directories, which they share on the
+# single-node cluster entrypoint.sh starts.
+if EVENT_LOADER == "dataset":
+    events = interaction_dataset(snapshot_until)
+    if TRAINING_MODE == "sweep" and events is not None:
+        # Read MongoDB once; the holdout split and the final matrix share the aggregated blocks
+        events = events.materialize()
+    *interactions, summary = collect_interactions.remote(events, since)
+    summary = ray.get(summary)
+    events_until = summary["events_until"] or snapshot_until
+    changed_users, changed_books = summary["changed_users"], summary["changed_books"]
+else:
+    loader = load_aggregated_events if EVENT_LOADER == "aggregate" else load_events
+    events = ray.get(loader.remote(snapshot_until))
+    events_until = pc.max(events["received_at"]).as_py() if events.num_rows else snapshot_until
+    changed_users, changed_books = changed_since(events, since) if since is not None else (set(), set())
+    events = ray.put(events)
+    interactions = preprocess.remote(events)
+
+if USE_SNAPSHOT:
+    *interactions, matrix, user_ids, book_ids = merge_snapshot.remote(snapshot, *interactions)
+    del snapshot
+
+sweep_config, sweep_results = run_sweep(events) if TRAINING_MODE == "sweep" else (None, [])
+del events
+
+model, user_factors, book_factors, fit_mode = ray.get(
+    train_als.remote(*interactions, previous, changed_users, changed_books, sweep_config))
+user_list, book_list = user_factors["user_id"].tolist(), book_factors["book_id"].tolist()
 
 # === Save Local Files ===
 user_factors_file = "user_factors.parquet"
@@ -97,6 +1079,60 @@ book_factors.to_parquet(book_factors_file)
 with open(model_file, "wb") as f:
     pickle.dump(model, f)
 
+factor_version = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+factor_dir = os.path.abspath("factors")
+factor_manifest = write_factor_artifact(
+    factor_dir, factor_version,
+    user_list, model.user_factors,
+    book_list, model.item_factors
+)
+# High-water mark of the events this model saw; the next incremental run re-solves what came after
+factor_manifest["events_until"] = pd.Timestamp(events_until).isoformat() if events_until is not None else None
+factor_manifest["training_mode"] = "sweep" if TRAINING_MODE == "sweep" else fit_mode
+factor_manifest["als_config"] = als_config(sweep_config)
+if sweep_results:
+    factor_manifest["sweep"] = {
+        "k": int(os.environ.get("ALS_SWEEP_K", 10)),
+        "holdout_days": float(os.environ.get("ALS_SWEEP_HOLDOUT_DAYS", 7)),
+        "results": sweep_results,
+    }
+save_manifest(factor_dir, factor_manifest)
+
+factor_manifest = ray.get(write_seen_items_task.remote(factor_dir, factor_manifest, *interactions))
+
+# === Offline top-N precompute ===
+PRECOMPUTE_TOP_N = int(os.environ.get("ALS_PRECOMPUTE_TOP_N", 100))
+if PRECOMPUTE_TOP_N > 0:
+    factor_manifest = precompute_top_n(
+        factor_dir, factor_manifest, PRECOMPUTE_TOP_N,
+        block_size=int(os.environ.get("ALS_PRECOMPUTE_BLOCK_SIZE", 4096)),
+        num_shards=int(os.environ.get("ALS_PRECOMPUTE_SHARDS", 1))
+    )
+
+# === Item-item similarity for "more like this" ===
+SIMILAR_TOP_M = int(os.environ.get("ALS_SIMILAR_TOP_M", 50))
+if SIMILAR_TOP_M > 0:
+    factor_manifest = precompute_similar_items(
+        factor_dir, factor_manifest, SIMILAR_TOP_M,
+        block_size=int(os.environ.get("ALS_PRECOMPUTE_BLOCK_SIZE", 4096)),
+        num_shards=int(os.environ.get("ALS_PRECOMPUTE_SHARDS", 1)),
+        min_score=float(os.environ.get("ALS_SIMILAR_MIN_SCORE", 0.0))
+    )
+
+# === Popularity rankings for cold-start users ===
+POPULAR_TOP_N = int(os.environ.get("ALS_POPULAR_TOP_N", 200))
+if POPULAR_TOP_N > 0:
+    factor_manifest = ray.get(precompute_popularity_task.remote(
+        factor_dir, factor_manifest, interactions[0], interactions[2], load_book_genres(), POPULAR_TOP_N
+    ))
+
+if USE_SNAPSHOT:
+    interaction_dir = os.path.abspath("interactions")
+    interaction_manifest = ray.get(save_interaction_snapshot_task.remote(
+        interaction_dir, factor_version, matrix, user_ids, book_ids,
+        pd.Timestamp(events_until).isoformat() if events_until is not None else None
+    ))
+
 logging.info("Local model & features saved!")
 
 # === Upload to S3 ===
@@ -115,6 +1151,19 @@ upload_to_s3(user_factors_file, S3_USER_FACTORS_PATH)
 upload_to_s3(book_factors_file, S3_BOOK_FACTORS_PATH)
 upload_to_s3(model_file, S3_MODEL_PATH)
 
+# Versioned binary factors first, manifest last: readers only ever see complete versions
+S3_FACTORS_PATH = s3_uri + "factors/"
+for file_name in factor_manifest["files"].values():
+    upload_to_s3(os.path.join(factor_dir, file_name), f"{S3_FACTORS_PATH}{factor_version}/{file_name}")
+upload_to_s3(os.path.join(factor_dir, "manifest.json"), S3_FACTORS_PATH + "manifest.json")
+
+# Same ordering for the interaction snapshot the next run merges onto
+if USE_SNAPSHOT:
+    S3_INTERACTIONS_PATH = s3_uri + "interactions/"
+    for file_name in interaction_manifest["files"].values():
+        upload_to_s3(os.path.join(interaction_dir, file_name), f"{S3_INTERACTIONS_PATH}{factor_version}/{file_name}")
+    upload_to_s3(os.path.join(interaction_dir, "manifest.json"), S3_INTERACTIONS_PATH + "manifest.json")
+
 logging.info("Training workflow completed & uploaded to S3 successfully!")
 # ---- Stop Ray cleanly to prevent Airflow duplicate task run ----
 ray.shutdown()
@@ -0,0 +1,71 @@
+"""
+Vectorized event preprocessing for ALS training, kept free of Ray and I/O so
+it can be benchmarked on its own (benchmarks/preprocess_bench.py).
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import scipy.sparse as sp
+
+VALID_EVENT_TYPES = ["read", "page_turn", "review", "bookmark_add"]
+# Interaction weight per event type; anything else valid counts 1.0
+EVENT_WEIGHTS = {"review": 3.0, "read": 2.0}
+DEFAULT_EVENT_WEIGHT = 1.0
+
+
+def _chunks(column):
+    return column.chunks if isinstance(column, pa.ChunkedArray) else [column]
+
+
+def factorize(column):
+    """int32 codes and first-seen unique values of an Arrow string column, hashed in Arrow."""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks() if column.num_chunks else pa.array([], type=column.type)
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    encoded = column.dictionary_encode()
+    codes = encoded.indices.to_numpy(zero_copy_only=False).astype(np.int32, copy=False)
+    return codes, encoded.dictionary.to_pylist()
+
+
+def event_weights(column):
+    """float32 weight per event through a lookup table indexed by the event-type dictionary codes."""
+    weights = []
+    for chunk in _chunks(column):
+        if not pa.types.is_dictionary(chunk.type):
+            chunk = chunk.dictionary_encode()
+        table = np.array(
+            [EVENT_WEIGHTS.get(t, DEFAULT_EVENT_WEIGHT) for t in chunk.dictionary.to_pylist()],
+            dtype=np.float32
+        )
+        weights.append(table[chunk.indices.to_numpy(zero_copy_only=False)])
+    return np.concatenate(weights) if weights else np.empty(0, dtype=np.float32)
+
+
+def build_interactions(events):
+    """
+    Turn an Arrow table of events (user_id, item_id and either event_type or a
+    pre-aggregated weight) into one row per (user, book) with summed weights.
+    Returns a frame of int32 user_idx/book_idx and float32 weight, plus the user
+    and book id lists the indices point into.
+    """
+    user_codes, user_list = factorize(events["user_id"])
+    book_codes, book_list = factorize(events["item_id"])
+    if "weight" in events.column_names:
+        weights = events["weight"].to_numpy().astype(np.float32, copy=False)
+    else:
+        weights = event_weights(events["event_type"])
+
+    # CSR conversion sums duplicate (user, book) pairs in compiled code
+    summed = sp.coo_matrix(
+        (weights, (user_codes, book_codes)),
+        shape=(len(user_list), len(book_list))
+    ).tocsr()
+    summed.sum_duplicates()
+    pairs = summed.tocoo()
+    df = pd.DataFrame({
+        "user_idx": pairs.row.astype(np.int32, copy=False),
+        "book_idx": pairs.col.astype(np.int32, copy=False),
+        "weight": pairs.data.astype(np.float32, copy=False),
+    })
+    return df, user_list, book_list
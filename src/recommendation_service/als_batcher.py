@@ -0,0 +1,79 @@
+import os
+import asyncio
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+ALS_MICROBATCH_MAX_SIZE = int(os.getenv("ALS_MICROBATCH_MAX_SIZE", 64))
+ALS_MICROBATCH_MAX_WAIT_MS = float(os.getenv("ALS_MICROBATCH_MAX_WAIT_MS", 2))
+
+ScoreFn = Callable[[object, np.ndarray, int, List[np.ndarray]], Tuple[np.ndarray, np.ndarray]]
+
+
+class MicroBatcher:
+    """
+    Gathers single-user ALS scoring requests into one matrix-matrix product.
+
+    A batch is flushed when it reaches max_batch_size or its wait window expires.
+    The window only applies while another batch is already scoring: an idle batcher
+    flushes on the next loop iteration, so light traffic pays no extra latency and
+    batches form on their own as load rises. Scoring runs in a worker thread; requests
+    against different factor snapshots are never mixed in one product.
+    """
+
+    def __init__(self, score_fn: ScoreFn, max_batch_size: int = ALS_MICROBATCH_MAX_SIZE,
+                 max_wait_ms: float = ALS_MICROBATCH_MAX_WAIT_MS):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = 0
+        self.batches = 0
+        self.batched_requests = 0
+
+    async def score(self, snapshot, user_vec: np.ndarray, top_k: int,
+                    exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k book rows and scores for one user vector, best first, never picking exclude rows."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if exclude is None:
+            exclude = np.empty(0, dtype=np.int32)
+        self._pending.append((snapshot, user_vec, top_k, exclude, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait if self._running else 0, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        groups = {}
+        for item in pending:
+            groups.setdefault(id(item[0]), []).append(item)
+        for items in groups.values():
+            asyncio.ensure_future(self._run(items))
+
+    async def _run(self, items: List[tuple]):
+        snapshot = items[0][0]
+        user_vecs = np.stack([item[1] for item in items])
+        k = max(item[2] for item in items)
+        exclude = [item[3] for item in items]
+        self._running += 1
+        try:
+            indices, scores = await asyncio.to_thread(self.score_fn, snapshot, user_vecs, k, exclude)
+        except Exception as e:
+            for *_, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._running -= 1
+        self.batches += 1
+        self.batched_requests += len(items)
+        for row, (_, _, top_k, _, future) in enumerate(items):
+            # Callers that gave up (cancelled) simply don't get a result
+            if not future.done():
+                future.set_result((indices[row, :top_k], scores[row, :top_k]))
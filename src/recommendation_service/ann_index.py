@@ -0,0 +1,180 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+from typing import List, Optional, Set, Tuple
+import numpy as np
+from collaborative_filtering import top_k_indices
+from factor_store import ALS_PREFIX, ensure_local_artifact, fetch_manifest, prune_local_artifacts, refresh_periodically
+
+logger = logging.getLogger(__name__)
+
+ANN_PREFIX = f"{ALS_PREFIX}/ann"
+ANN_CACHE_DIR = os.getenv("ANN_INDEX_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ann_index"))
+ANN_REFRESH_SECONDS = float(os.getenv("ANN_REFRESH_SECONDS", 3600))
+ANN_N_PROBE = int(os.getenv("ANN_N_PROBE", 16))
+
+ANN_FILES = {
+    "ids": "ids.npy",
+    "vectors": "vectors.npy",
+    "centroids": "centroids.npy",
+    "list_offsets": "list_offsets.npy",
+}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 65536) -> np.ndarray:
+    return np.concatenate([
+        np.argmax(vectors[start:start + block_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), block_size)
+    ])
+
+
+def _kmeans(vectors: np.ndarray, n_lists: int, iterations: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # Centroids are trained on a sample; every vector is assigned afterwards
+    sample_size = min(len(vectors), 64 * n_lists)
+    vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = vectors[:n_lists].copy()
+    for _ in range(iterations):
+        assignment = _assign(vectors, centroids)
+        for c in range(n_lists):
+            members = vectors[assignment == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index with exact (flat) scoring inside each probed list.
+    Vectors are L2-normalised, so inner product equals the cosine score Pinecone returns.
+    Vectors are stored grouped by list: list c owns rows list_offsets[c]:list_offsets[c + 1].
+    """
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray, centroids: np.ndarray,
+                 list_offsets: np.ndarray, version: Optional[str] = None):
+        self.ids = ids
+        self.vectors = vectors
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.version = version
+
+    @classmethod
+    def build(cls, ids: List[str], vectors: np.ndarray, n_lists: Optional[int] = None,
+              iterations: int = 10, seed: int = 0) -> "IVFFlatIndex":
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+        centroids = _kmeans(vectors, n_lists, iterations, seed)
+        assignment = _assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=list_offsets[1:])
+        return cls(
+            np.asarray([str(i) for i in ids])[order],
+            np.ascontiguousarray(vectors[order]),
+            centroids.astype(np.float32),
+            list_offsets,
+        )
+
+    def save(self, out_dir: str, version: str) -> dict:
+        os.makedirs(out_dir, exist_ok=True)
+        for key, file_name in ANN_FILES.items():
+            np.save(os.path.join(out_dir, file_name), getattr(self, key))
+        manifest = {
+            "format_version": 1,
+            "version": version,
+            "index_type": "ivf_flat",
+            "metric": "cosine",
+            "num_vectors": len(self.ids),
+            "dimension": int(self.vectors.shape[1]),
+            "n_lists": len(self.centroids),
+            "files": ANN_FILES,
+        }
+        with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        return manifest
+
+    @classmethod
+    def load(cls, local_dir: str, manifest: dict) -> "IVFFlatIndex":
+        files = manifest["files"]
+        arrays = {key: np.load(os.path.join(local_dir, files[key]), mmap_mode="r") for key in ANN_FILES}
+        return cls(version=manifest["version"], **arrays)
+
+    def search(self, query, top_k: int = 50, n_probe: int = ANN_N_PROBE,
+               exclude: Optional[Set[str]] = None) -> Tuple[List[str], List[float]]:
+        """Approximate top_k book ids by cosine similarity, skipping ids in exclude."""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        n_probe = min(n_probe, len(self.centroids))
+        probe = top_k_indices(self.centroids @ query, n_probe)
+        rows = np.concatenate([
+            np.arange(self.list_offsets[c], self.list_offsets[c + 1]) for c in probe
+        ])
+        if len(rows) == 0:
+            return [], []
+        scores = self.vectors[rows] @ query
+        if exclude:
+            keep = ~np.isin(self.ids[rows], list(exclude))
+            rows, scores = rows[keep], scores[keep]
+        best = top_k_indices(scores, top_k)
+        return self.ids[rows[best]].tolist(), scores[best].tolist()
+
+
+class AnnIndexStore:
+    """
+    Keeps the latest published book-vector index memory-mapped and swaps in newer versions.
+    """
+
+    def __init__(self, refresh_interval: float = ANN_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._index: Optional[IVFFlatIndex] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def index(self) -> Optional[IVFFlatIndex]:
+        return self._index
+
+    def _load(self, manifest: dict) -> IVFFlatIndex:
+        local_dir = ensure_local_artifact(manifest, ANN_PREFIX, ANN_CACHE_DIR)
+        index = IVFFlatIndex.load(local_dir, manifest)
+        previous = self._index.version if self._index else None
+        prune_local_artifacts([manifest["version"]] + ([previous] if previous else []), ANN_CACHE_DIR)
+        return index
+
+    async def refresh(self) -> bool:
+        manifest = await asyncio.to_thread(fetch_manifest, ANN_PREFIX)
+        if manifest is None:
+            return False
+        if self._index is not None and self._index.version == manifest["version"]:
+            return False
+        self._index = await asyncio.to_thread(self._load, manifest)
+        logger.info(f"Loaded ANN book index version {manifest['version']}: {manifest['num_vectors']} vectors")
+        return True
+
+    async def start(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Initial ANN index load failed: {e}")
+        self._refresh_task = asyncio.create_task(
+            refresh_periodically(self.refresh, self.refresh_interval, "ANN index"))
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+
+store = AnnIndexStore()
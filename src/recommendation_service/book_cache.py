@@ -0,0 +1,85 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+BOOK_CACHE_SIZE = int(os.getenv("BOOK_CACHE_SIZE", 100000))
+BOOK_CACHE_TTL_SECONDS = float(os.getenv("BOOK_CACHE_TTL_SECONDS", 3600))
+
+FetchBooks = Callable[[List[str]], Awaitable[List[dict]]]
+
+
+class BookMetadataCache:
+    """
+    In-process LRU + TTL cache of book metadata rows keyed by book id.
+    Only touched from the event loop, hence no locking.
+    """
+
+    def __init__(self, max_size: int = BOOK_CACHE_SIZE, ttl: float = BOOK_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, book_id: str):
+        entry = self._entries.get(book_id)
+        if entry is None:
+            return None
+        expires_at, book = entry
+        if expires_at < time.monotonic():
+            del self._entries[book_id]
+            return None
+        self._entries.move_to_end(book_id)
+        return book
+
+    def put_many(self, books: Iterable[dict]):
+        expires_at = time.monotonic() + self.ttl
+        for book in books:
+            book_id = book.get("id") or book.get("_id")
+            if book_id is None:
+                continue
+            self._entries[str(book_id)] = (expires_at, book)
+            self._entries.move_to_end(str(book_id))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_many(self, ids: List[str], fetch_books: FetchBooks) -> List[dict]:
+        """
+        Return metadata for ids in input order, fetching only the misses in one call.
+        Ids unknown to the backing store are skipped. Rows are shallow copies so
+        callers can annotate them without touching the cache.
+        """
+        found = {}
+        missing = []
+        for book_id in dict.fromkeys(str(bid) for bid in ids):
+            book = self._get(book_id)
+            if book is None:
+                missing.append(book_id)
+            else:
+                found[book_id] = book
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if missing:
+            fetched = await fetch_books(missing)
+            self.put_many(fetched)
+            for book in fetched:
+                found[str(book.get("id") or book.get("_id"))] = book
+
+        return [dict(found[str(bid)]) for bid in ids if str(bid) in found]
+
+    async def warm(self, fetch_all_books: Callable[[], Awaitable[List[dict]]]) -> int:
+        books = await fetch_all_books()
+        self.put_many(books)
+        logger.info(f"Book metadata cache warmed with {len(books)} books")
+        return len(books)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+book_cache = BookMetadataCache()
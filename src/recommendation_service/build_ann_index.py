@@ -0,0 +1,72 @@
+"""
+Export book vectors from Pinecone, build the local IVF-flat index and publish it
+to S3 for the recommendation service to memory-map.
+
+Pinecone stays the source of truth: run this after book_data_importer/book_embedding.py
+upserts new books (or on a schedule) to resync the local index.
+
+    python build_ann_index.py [--n-lists N] [--out-dir DIR] [--no-upload]
+"""
+import os
+import argparse
+from datetime import datetime
+from itertools import islice
+import numpy as np
+from pinecone import Pinecone
+from ann_index import ANN_PREFIX, IVFFlatIndex
+from factor_store import S3_BUCKET, s3
+
+BOOK_INDEX_NAME = "book-metadata-index"
+NAMESPACE = "__default__"
+FETCH_BATCH_SIZE = 100
+
+
+def chunked(iterable, n):
+    iterator = iter(iterable)
+    for first in iterator:
+        yield [first] + list(islice(iterator, n - 1))
+
+
+def export_book_vectors():
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    book_index = pc.Index(BOOK_INDEX_NAME)
+    ids, vectors = [], []
+    all_ids = (book_id for page in book_index.list(namespace=NAMESPACE) for book_id in page)
+    for batch in chunked(all_ids, FETCH_BATCH_SIZE):
+        fetched = book_index.fetch(ids=batch, namespace=NAMESPACE).vectors
+        for book_id, record in fetched.items():
+            ids.append(book_id)
+            vectors.append(record.values)
+        print(f"Exported {len(ids)} book vectors")
+    return ids, np.asarray(vectors, dtype=np.float32)
+
+
+def upload_index(local_dir, manifest):
+    version = manifest["version"]
+    for file_name in manifest["files"].values():
+        s3.upload_file(os.path.join(local_dir, file_name), S3_BUCKET, f"{ANN_PREFIX}/{version}/{file_name}")
+    # Manifest last so the service never sees a partially uploaded version
+    s3.upload_file(os.path.join(local_dir, "manifest.json"), S3_BUCKET, f"{ANN_PREFIX}/manifest.json")
+    print(f"Published ANN index {version} to s3://{S3_BUCKET}/{ANN_PREFIX}/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n-lists", type=int, default=None, help="IVF lists (default: sqrt(num books))")
+    parser.add_argument("--out-dir", default="ann_index_build")
+    parser.add_argument("--no-upload", action="store_true")
+    args = parser.parse_args()
+
+    ids, vectors = export_book_vectors()
+    if not ids:
+        raise SystemExit("No book vectors found in Pinecone")
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    index = IVFFlatIndex.build(ids, vectors, n_lists=args.n_lists)
+    manifest = index.save(args.out_dir, version)
+    print(f"Built IVF-flat index: {manifest['num_vectors']} vectors, {manifest['n_lists']} lists")
+    if not args.no_upload:
+        upload_index(args.out_dir, manifest)
+
+
+if __name__ == "__main__":
+    main()
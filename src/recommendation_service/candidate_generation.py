@@ -0,0 +1,56 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import content_based_recommendation as cbr
+import collaborative_filtering as cf
+from metrics import SOURCE_ERRORS, SOURCE_TIMEOUTS, time_stage
+
+logger = logging.getLogger(__name__)
+
+Candidates = Tuple[List[str], List[float]]
+SourceFn = Callable[[str, int], Awaitable[Candidates]]
+
+# Per-source latency budgets; a source that misses its budget is dropped from the response
+SOURCES: Dict[str, Tuple[SourceFn, float]] = {
+    "content_based": (cbr.dense_vector_recommendation, float(os.getenv("CB_SOURCE_TIMEOUT_MS", 400)) / 1000),
+    "als": (cf.recommend_als_books, float(os.getenv("ALS_SOURCE_TIMEOUT_MS", 150)) / 1000),
+}
+
+
+async def _run_source(name: str, fn: SourceFn, user_id: str, top_k: int, timeout: float) -> Optional[Candidates]:
+    started = time.perf_counter()
+    try:
+        with time_stage(f"source_{name}"):
+            return await asyncio.wait_for(fn(user_id, top_k), timeout=timeout)
+    except asyncio.TimeoutError:
+        SOURCE_TIMEOUTS.labels(source=name).inc()
+        logger.warning(f"Candidate source {name} timed out after {timeout * 1000:.0f}ms for user {user_id}")
+    except Exception as e:
+        SOURCE_ERRORS.labels(source=name).inc()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logger.error(f"Candidate source {name} failed after {elapsed_ms:.0f}ms for user {user_id}: {e}")
+    return None
+
+
+async def generate_candidates(
+    user_id: str,
+    top_k: int = 50,
+    sources: Optional[Dict[str, Tuple[SourceFn, float]]] = None,
+) -> Dict[str, Candidates]:
+    """
+    Run every candidate source concurrently, each under its own deadline.
+    Returns the (ids, scores) of the sources that finished in time, keyed by source name.
+    """
+    sources = SOURCES if sources is None else sources
+    names = list(sources)
+    results = await asyncio.gather(*(
+        _run_source(name, fn, user_id, top_k, timeout)
+        for name, (fn, timeout) in sources.items()
+    ))
+    candidates = {name: result for name, result in zip(names, results) if result is not None}
+    missing = [name for name in names if name not in candidates]
+    if missing:
+        logger.info(f"Returning partial candidates for user {user_id}; missing sources: {missing}")
+    return candidates
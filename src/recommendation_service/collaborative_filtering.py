@@ -1,43 +1,153 @@
 import os
-from typing import List, Tuple
-import pandas as pd
-import numpy as np
 import asyncio
-import boto3
-from io import BytesIO
+import logging
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from factor_store import store
+from als_batcher import MicroBatcher
+from metrics import log_sampled, time_stage
+from seen_items import seen_rows
+
+logger = logging.getLogger(__name__)
+
+# Rows of the user x book score matrix materialised at once by the batch scorer
+SCORING_BLOCK_SIZE = 1024
+# Batch concurrent online scoring requests into one GEMM
+ALS_MICROBATCH = os.getenv("ALS_MICROBATCH", "true").lower() == "true"
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores along the last axis, best first.
+    Uses argpartition so only the selected k are fully sorted.
+    """
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(-candidate_scores, axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+def mask_seen(block_scores: np.ndarray, exclude: Optional[Sequence[np.ndarray]], start: int):
+    """Push each user's excluded book rows to -inf so top-k never picks them."""
+    if exclude is None:
+        return
+    for i, rows in enumerate(exclude[start:start + block_scores.shape[0]]):
+        if len(rows):
+            block_scores[i, rows] = -np.inf
+
+
+def score_user_vectors(
+    user_vecs: np.ndarray,
+    book_factors: np.ndarray,
+    top_k: int = 50,
+    block_size: int = SCORING_BLOCK_SIZE,
+    exclude: Optional[Sequence[np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score a (n_users, factors) matrix against every book with one GEMM per block of users.
+    Returns (n_users, k) arrays of book row indices and scores, best first.
+    exclude holds per-user book rows that are masked before top-k; they only
+    come back, scored -inf, when fewer than k books remain.
+    """
+    user_vecs = np.atleast_2d(np.asarray(user_vecs, dtype=np.float32))
+    k = min(top_k, book_factors.shape[0])
+    indices = np.empty((user_vecs.shape[0], k), dtype=np.intp)
+    scores = np.empty((user_vecs.shape[0], k), dtype=np.float32)
+    for start in range(0, user_vecs.shape[0], block_size):
+        block_scores = user_vecs[start:start + block_size] @ book_factors.T
+        mask_seen(block_scores, exclude, start)
+        block_indices = top_k_indices(block_scores, k)
+        indices[start:start + block_size] = block_indices
+        scores[start:start + block_size] = np.take_along_axis(block_scores, block_indices, axis=-1)
+    return indices, scores
+
 
-S3_BUCKET = os.getenv("S3_URI")
-ALS_PREFIX = os.getenv("ALS_S3_PREFIX")
+def _score(snapshot, user_vecs: np.ndarray, top_k: int,
+           exclude: Optional[Sequence[np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    return score_user_vectors(user_vecs, snapshot.book_factors, top_k, exclude=exclude)
 
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-)
 
-def _download_parquet(bucket: str, s3_key: str):
-    s3_obj = s3.get_object(Bucket=bucket, Key=s3_key)
-    return pd.read_parquet(BytesIO(s3_obj["Body"].read()))
+def _finite(book_rows: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Masked books only surface, at -inf, when the user has seen nearly the whole catalog
+    keep = np.isfinite(scores)
+    return book_rows[keep], scores[keep]
+
+
+batcher = MicroBatcher(_score)
+
 
 async def recommend_als_books(user_id: str, top_k: int = 50) -> Tuple[List[str], List[float]]:
-    loop = asyncio.get_running_loop()
-    user_factors, book_factors = await asyncio.gather(
-        loop.run_in_executor(None, _download_parquet, S3_BUCKET, f"{ALS_PREFIX}/user_factors.parquet"),
-        loop.run_in_executor(None, _download_parquet, S3_BUCKET, f"{ALS_PREFIX}/book_factors.parquet"),
-    )
-
-    user_row = user_factors[user_factors["user_id"] == user_id]
-    if user_row.empty:
+    snapshot = store.snapshot
+    if snapshot is None:
         return [], []
 
-    user_vec = user_row.drop(columns=["user_id"]).to_numpy().flatten()
-    book_vecs = book_factors.drop(columns=["book_id"]).to_numpy()
-    book_ids = book_factors["book_id"].values
+    # Books the user already read, bookmarked or reviewed are never recommended again
+    seen = seen_rows(snapshot, user_id)
+
+    # Cold-start users have no factor row: answer from the popularity ranking without scoring
+    if snapshot.user_row(user_id) is None:
+        popular = snapshot.popular(top_k, exclude_rows=seen)
+        if popular is None:
+            return [], []
+        log_sampled(logger, "als_recommendations", user_id=user_id, source="popular",
+                    book_ids=popular[0], scores=popular[1])
+        return popular
+
+    # Served straight from the offline top-N table when the model shipped one
+    with time_stage("scoring"):
+        precomputed = snapshot.precomputed(user_id, top_k, exclude_rows=seen)
+    if precomputed is not None:
+        log_sampled(logger, "als_recommendations", user_id=user_id, source="precomputed",
+                    book_ids=precomputed[0], scores=precomputed[1])
+        return precomputed
+
+    user_vec = snapshot.user_vector(user_id)
+    if user_vec is None:
+        return [], []
 
     # Compute relevance scores and select top_k
-    scores = book_vecs @ user_vec
-    top_indices = np.argsort(scores)[::-1][:top_k]
-    recommended_books = book_ids[top_indices]
-    recommended_scores = scores[top_indices]
-    print(f"ALS Recommendations for user {user_id}: {recommended_books} with scores {recommended_scores}")
-    return recommended_books.tolist(), recommended_scores.tolist()
+    with time_stage("scoring"):
+        if ALS_MICROBATCH:
+            top_indices, top_scores = await batcher.score(snapshot, user_vec, top_k, seen)
+        else:
+            top_indices, top_scores = (a[0] for a in _score(snapshot, user_vec, top_k, [seen]))
+    top_indices, top_scores = _finite(top_indices, top_scores)
+    recommended_books = snapshot.book_ids[top_indices].tolist()
+    recommended_scores = top_scores.tolist()
+    log_sampled(logger, "als_recommendations", user_id=user_id, source="online",
+                book_ids=recommended_books, scores=recommended_scores)
+    return recommended_books, recommended_scores
+
+
+async def recommend_als_books_batch(user_ids: List[str], top_k: int = 50) -> List[Tuple[List[str], List[float]]]:
+    """
+    Batch variant of recommend_als_books. Results are in input order;
+    users without factors get the popularity ranking, or empty lists without one.
+    """
+    snapshot = store.snapshot
+    if snapshot is None or not user_ids:
+        return [([], []) for _ in user_ids]
+
+    rows = [snapshot.user_row(uid) for uid in user_ids]
+    known = [i for i, row in enumerate(rows) if row is not None]
+    seen = [seen_rows(snapshot, uid) for uid in user_ids]
+    results = [
+        (snapshot.popular(top_k, exclude_rows=seen[i]) or ([], [])) if row is None else ([], [])
+        for i, row in enumerate(rows)
+    ]
+    if not known:
+        return results
+
+    user_vecs = snapshot.user_factors[[rows[i] for i in known]]
+    indices, scores = await asyncio.to_thread(_score, snapshot, user_vecs, top_k, [seen[i] for i in known])
+    for i, book_rows, book_scores in zip(known, indices, scores):
+        book_rows, book_scores = _finite(book_rows, book_scores)
+        results[i] = (snapshot.book_ids[book_rows].tolist(), book_scores.tolist())
+    return results
@@ -1,26 +1,59 @@
 import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import List, Tuple
 from pinecone import Pinecone
+from ann_index import store as ann_store
+from metrics import log_sampled, time_stage
+from seen_items import seen_book_ids
+
+logger = logging.getLogger(__name__)
 
 BOOK_INDEX_NAME = "book-metadata-index"
 USER_INDEX_NAME = "user-preferences-index"
+# Pinecone can't exclude ids server-side, so seen books are over-fetched (up to this many) and dropped
+CB_SEEN_OVERFETCH_MAX = int(os.getenv("CB_SEEN_OVERFETCH_MAX", 100))
+# The Pinecone SDK is blocking. Its calls get their own pool so a slow vendor, or calls abandoned
+# at the source deadline that still hold their thread, can't starve ALS scoring and index refreshes
+# on the default executor
+PINECONE_IO_THREADS = int(os.getenv("PINECONE_IO_THREADS", 32))
+_pinecone_executor = ThreadPoolExecutor(max_workers=PINECONE_IO_THREADS, thread_name_prefix="pinecone-io")
 
 # Pinecone clients (ensure singleton/efficient usage in real app)
 pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
 book_index = pc.Index(BOOK_INDEX_NAME)
 user_index = pc.Index(USER_INDEX_NAME)
 
+
+def _pinecone_call(fn, **kwargs):
+    return asyncio.get_running_loop().run_in_executor(_pinecone_executor, partial(fn, **kwargs))
+
+
 async def dense_vector_recommendation(user_id: str, top_k: int = 50) -> Tuple[List[str], List[float]]:
     # 1. Get user vector
-    query_result = user_index.fetch(ids=[str(user_id)], namespace="__default__")
+    with time_stage("pinecone_fetch"):
+        query_result = await _pinecone_call(user_index.fetch, ids=[str(user_id)], namespace="__default__")
     user_vectors = query_result.vectors
     user_record = user_vectors.get(str(user_id), None)
     user_vector = user_record.values if user_record else None
     if not user_vector:
         return [], []
 
-    # 2. Query books using dense user vector
-    results = book_index.query(vector=user_vector, top_k=top_k, namespace="__default__")
+    # 2. Query books using dense user vector: the local ANN index when one is loaded,
+    #    otherwise Pinecone, which stays the source of truth for book vectors
+    seen = seen_book_ids(str(user_id))
+    local_index = ann_store.index
+    if local_index is not None:
+        with time_stage("ann_query"):
+            book_ids, scores = await asyncio.to_thread(local_index.search, user_vector, top_k, exclude=seen)
+        log_sampled(logger, "cb_recommendations", user_id=user_id, source="ann", book_ids=book_ids, scores=scores)
+        return book_ids, scores
+    with time_stage("pinecone_query"):
+        results = await _pinecone_call(
+            book_index.query, vector=user_vector, top_k=top_k + min(len(seen), CB_SEEN_OVERFETCH_MAX),
+            namespace="__default__")
 
     # 3. Extract book ids and scores (similarity/distance depending on Pinecone metric)
     book_ids = []
@@ -28,8 +61,9 @@ async def dense_vector_recommendation(user_id: str, top_k: int = 50) -> Tuple[Li
     for match in results.matches:
         book_id = match.get("_id") or match.get("id")
         score = match.get("score")
-        if book_id is not None and score is not None:
+        if book_id is not None and score is not None and book_id not in seen:
             book_ids.append(book_id)
             scores.append(score)
-    print(f"CB Recommendations for user {user_id}: {book_ids} with scores {scores}")
+    book_ids, scores = book_ids[:top_k], scores[:top_k]
+    log_sampled(logger, "cb_recommendations", user_id=user_id, source="pinecone", book_ids=book_ids, scores=scores)
     return book_ids, scores
@@ -0,0 +1,356 @@
+import os
+import json
+import shutil
+import asyncio
+import logging
+import tempfile
+from io import BytesIO
+from typing import Awaitable, Callable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import boto3
+from metrics import time_stage
+
+logger = logging.getLogger(__name__)
+
+S3_BUCKET = os.getenv("S3_URI")
+ALS_PREFIX = os.getenv("ALS_S3_PREFIX")
+REFRESH_INTERVAL_SECONDS = float(os.getenv("ALS_REFRESH_SECONDS", 300))
+
+USER_FACTORS_KEY = f"{ALS_PREFIX}/user_factors.parquet"
+BOOK_FACTORS_KEY = f"{ALS_PREFIX}/book_factors.parquet"
+FACTORS_PREFIX = f"{ALS_PREFIX}/factors"
+# Shared by every worker process in the pod so they all map the same page-cached files
+FACTOR_CACHE_DIR = os.getenv("ALS_FACTOR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "als_factors"))
+
+s3 = boto3.client(
+    "s3",
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+)
+
+
+def _download_parquet(bucket: str, s3_key: str, etag: Optional[str] = None):
+    kwargs = {"Bucket": bucket, "Key": s3_key}
+    if etag:
+        # Fail instead of mixing two model versions if the object changed after we versioned it
+        kwargs["IfMatch"] = etag
+    s3_obj = s3.get_object(**kwargs)
+    return pd.read_parquet(BytesIO(s3_obj["Body"].read()))
+
+
+def _split_factors(df: pd.DataFrame, id_column: str) -> Tuple[np.ndarray, np.ndarray]:
+    ids = df[id_column].to_numpy().astype(str)
+    order = np.argsort(ids, kind="stable")
+    factors = np.ascontiguousarray(df.drop(columns=[id_column]).to_numpy(dtype=np.float32)[order])
+    return ids[order], factors
+
+
+def fetch_manifest(prefix: str = FACTORS_PREFIX) -> Optional[dict]:
+    try:
+        s3_obj = s3.get_object(Bucket=S3_BUCKET, Key=f"{prefix}/manifest.json")
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(s3_obj["Body"].read())
+
+
+def ensure_local_artifact(manifest: dict, prefix: str = FACTORS_PREFIX, cache_dir: str = FACTOR_CACHE_DIR) -> str:
+    """
+    Download one artifact version into a shared cache directory unless another
+    worker already did. Files land in a temp dir first and are renamed into place,
+    so a version directory is either complete or absent.
+    """
+    version = manifest["version"]
+    local_dir = os.path.join(cache_dir, version)
+    if os.path.isdir(local_dir):
+        return local_dir
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{version}-", dir=cache_dir)
+    try:
+        for file_name in manifest["files"].values():
+            s3.download_file(S3_BUCKET, f"{prefix}/{version}/{file_name}", os.path.join(tmp_dir, file_name))
+        try:
+            os.rename(tmp_dir, local_dir)
+        except OSError:
+            # Lost the race to another worker; its copy is identical
+            if not os.path.isdir(local_dir):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return local_dir
+
+
+def prune_local_artifacts(keep: List[str], cache_dir: str = FACTOR_CACHE_DIR):
+    # Unlinking files that other workers still map is safe; the pages live until they unmap
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        if name not in keep and not name.startswith("."):
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+async def refresh_periodically(refresh: Callable[[], Awaitable[bool]], interval: float, name: str):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh()
+        except Exception as e:
+            logger.error(f"{name} refresh failed: {e}")
+
+
+def _version_of(user_etag: str, book_etag: str) -> str:
+    return user_etag.strip('"') + ":" + book_etag.strip('"')
+
+
+def drop_rows(rows: np.ndarray, scores: np.ndarray, exclude_rows: Optional[np.ndarray],
+              top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The first top_k (rows, scores) of a ranking, skipping rows in exclude_rows."""
+    if exclude_rows is not None and len(exclude_rows):
+        keep = ~np.isin(rows, exclude_rows)
+        rows, scores = rows[keep], scores[keep]
+    return rows[:top_k], scores[:top_k]
+
+
+def normalize_genre(genre: str) -> str:
+    return genre.strip().lower()
+
+
+class PopularityTable:
+    """
+    Global and per-genre popularity rankings published with the factors, as rows
+    of the sorted book table, best first. Per-genre rankings are CSR-style over
+    the sorted genre_names table.
+    """
+
+    def __init__(self, popular_rows: np.ndarray, popular_scores: np.ndarray, genre_names: np.ndarray,
+                 genre_indptr: np.ndarray, genre_rows: np.ndarray, genre_scores: np.ndarray):
+        self.popular_rows = popular_rows
+        self.popular_scores = popular_scores
+        self.genre_names = genre_names
+        self.genre_indptr = genre_indptr
+        self.genre_rows = genre_rows
+        self.genre_scores = genre_scores
+
+    def ranking(self, genre: Optional[str] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Book rows and scores of the full ranking, best first, or None for an unknown genre."""
+        if genre is None:
+            return self.popular_rows, self.popular_scores
+        key = normalize_genre(genre)
+        i = int(np.searchsorted(self.genre_names, key))
+        if i >= len(self.genre_names) or self.genre_names[i] != key:
+            return None
+        start, stop = int(self.genre_indptr[i]), int(self.genre_indptr[i + 1])
+        return self.genre_rows[start:stop], self.genre_scores[start:stop]
+
+
+class FactorSnapshot:
+    """
+    One published ALS model version, either resident or memory-mapped.
+    Id tables are sorted so rows are found by binary search without a per-process index.
+    Never mutated after construction, so readers can use it without locking.
+    """
+
+    def __init__(self, version: str, user_ids: np.ndarray, user_factors: np.ndarray,
+                 book_ids: np.ndarray, book_factors: np.ndarray,
+                 topn_indices: Optional[np.ndarray] = None, topn_scores: Optional[np.ndarray] = None,
+                 similar_indptr: Optional[np.ndarray] = None, similar_indices: Optional[np.ndarray] = None,
+                 similar_scores: Optional[np.ndarray] = None, popularity: Optional[PopularityTable] = None,
+                 seen_indptr: Optional[np.ndarray] = None, seen_indices: Optional[np.ndarray] = None):
+        self.version = version
+        self.user_ids = user_ids
+        self.user_factors = user_factors
+        self.book_ids = book_ids
+        self.book_factors = book_factors
+        # Offline top-N table aligned with user_ids: book rows and float16 scores, best first
+        self.topn_indices = topn_indices
+        self.topn_scores = topn_scores
+        # CSR item-item neighbour table over the book rows: indptr, book rows and float16 scores, best first
+        self.similar_indptr = similar_indptr
+        self.similar_indices = similar_indices
+        self.similar_scores = similar_scores
+        # Cold-start rankings for users without a factor row
+        self.popularity = popularity
+        # CSR over the user rows: sorted book rows each user interacted with up to training time
+        self.seen_indptr = seen_indptr
+        self.seen_indices = seen_indices
+
+    @staticmethod
+    def _find(ids: np.ndarray, key: str) -> Optional[int]:
+        row = int(np.searchsorted(ids, key))
+        if row < len(ids) and ids[row] == key:
+            return row
+        return None
+
+    def user_row(self, user_id: str) -> Optional[int]:
+        return self._find(self.user_ids, user_id)
+
+    def book_row(self, book_id: str) -> Optional[int]:
+        return self._find(self.book_ids, book_id)
+
+    def user_vector(self, user_id: str) -> Optional[np.ndarray]:
+        row = self.user_row(user_id)
+        if row is None:
+            return None
+        return self.user_factors[row]
+
+    def seen(self, user_id: str) -> np.ndarray:
+        """Sorted book rows the user had interacted with when the model was trained."""
+        row = self.user_row(user_id) if self.seen_indptr is not None else None
+        if row is None:
+            return np.empty(0, dtype=np.int32)
+        return self.seen_indices[int(self.seen_indptr[row]):int(self.seen_indptr[row + 1])]
+
+    def precomputed(self, user_id: str, top_k: int,
+                    exclude_rows: Optional[np.ndarray] = None) -> Optional[Tuple[List[str], List[float]]]:
+        """
+        The user's precomputed top_k without exclude_rows, or None when the table
+        is missing, too short for top_k, or has no row for the user.
+        """
+        if self.topn_indices is None or top_k > self.topn_indices.shape[1]:
+            return None
+        row = self.user_row(user_id)
+        if row is None:
+            return None
+        book_rows, scores = drop_rows(self.topn_indices[row], self.topn_scores[row], exclude_rows, top_k)
+        if len(book_rows) < top_k:
+            return None
+        return self.book_ids[book_rows].tolist(), scores.astype(np.float32).tolist()
+
+    def popular(self, top_k: int, genre: Optional[str] = None,
+                exclude_rows: Optional[np.ndarray] = None) -> Optional[Tuple[List[str], List[float]]]:
+        """
+        The top_k most popular books overall or within a genre, without
+        exclude_rows, or None when the table is missing or the genre is unknown.
+        """
+        if self.popularity is None:
+            return None
+        ranking = self.popularity.ranking(genre)
+        if ranking is None:
+            return None
+        book_rows, scores = drop_rows(*ranking, exclude_rows, top_k)
+        return self.book_ids[book_rows].tolist(), scores.astype(np.float32).tolist()
+
+    def similar(self, book_id: str, top_k: int) -> Optional[Tuple[List[str], List[float]]]:
+        """
+        Up to top_k precomputed neighbours of a book, or None when the table is
+        missing or the book is unknown to this model version.
+        """
+        if self.similar_indptr is None:
+            return None
+        row = self.book_row(book_id)
+        if row is None:
+            return None
+        start = int(self.similar_indptr[row])
+        stop = min(int(self.similar_indptr[row + 1]), start + top_k)
+        book_rows = self.similar_indices[start:stop]
+        return self.book_ids[book_rows].tolist(), self.similar_scores[start:stop].astype(np.float32).tolist()
+
+
+class FactorStore:
+    """
+    Keeps the latest ALS factors resident and swaps in newer versions in the background.
+    """
+
+    def __init__(self, refresh_interval: float = REFRESH_INTERVAL_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._snapshot: Optional[FactorSnapshot] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def snapshot(self) -> Optional[FactorSnapshot]:
+        return self._snapshot
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._snapshot.version if self._snapshot else None
+
+    def _remote_etags(self) -> Tuple[str, str]:
+        user_head = s3.head_object(Bucket=S3_BUCKET, Key=USER_FACTORS_KEY)
+        book_head = s3.head_object(Bucket=S3_BUCKET, Key=BOOK_FACTORS_KEY)
+        return user_head["ETag"], book_head["ETag"]
+
+    def _load_mapped(self, manifest: dict) -> FactorSnapshot:
+        local_dir = ensure_local_artifact(manifest)
+        files = manifest["files"]
+
+        def load(key):
+            if key not in files:
+                return None
+            return np.load(os.path.join(local_dir, files[key]), mmap_mode="r")
+
+        popularity = None
+        if "popular_rows" in files:
+            popularity = PopularityTable(
+                load("popular_rows"), load("popular_scores"), load("genre_names"),
+                load("genre_indptr"), load("genre_rows"), load("genre_scores"),
+            )
+
+        snapshot = FactorSnapshot(
+            manifest["version"],
+            load("user_ids"), load("user_factors"),
+            load("book_ids"), load("book_factors"),
+            load("topn_indices"), load("topn_scores"),
+            load("similar_indptr"), load("similar_indices"), load("similar_scores"),
+            popularity,
+            load("seen_indptr"), load("seen_indices"),
+        )
+        previous = self.version
+        prune_local_artifacts([manifest["version"]] + ([previous] if previous else []))
+        return snapshot
+
+    def _load_parquet(self, user_etag: str, book_etag: str) -> FactorSnapshot:
+        user_ids, user_factors = _split_factors(
+            _download_parquet(S3_BUCKET, USER_FACTORS_KEY, user_etag), "user_id")
+        book_ids, book_factors = _split_factors(
+            _download_parquet(S3_BUCKET, BOOK_FACTORS_KEY, book_etag), "book_id")
+        return FactorSnapshot(
+            _version_of(user_etag, book_etag), user_ids, user_factors, book_ids, book_factors)
+
+    async def refresh(self) -> bool:
+        """
+        Load the published factors if they differ from the resident version.
+        Prefers the memory-mapped binary artifact and falls back to the parquet
+        files for models trained before it existed.
+        Returns True when a new snapshot was swapped in.
+        """
+        current = self._snapshot
+        manifest = await asyncio.to_thread(fetch_manifest)
+        if manifest is not None:
+            if current is not None and current.version == manifest["version"]:
+                return False
+            with time_stage("factor_load"):
+                snapshot = await asyncio.to_thread(self._load_mapped, manifest)
+        else:
+            user_etag, book_etag = await asyncio.to_thread(self._remote_etags)
+            if current is not None and current.version == _version_of(user_etag, book_etag):
+                return False
+            with time_stage("factor_load"):
+                snapshot = await asyncio.to_thread(self._load_parquet, user_etag, book_etag)
+        # Single reference assignment: in-flight requests keep the snapshot they already hold
+        self._snapshot = snapshot
+        logger.info(
+            f"Loaded ALS factors version {snapshot.version}: "
+            f"{len(snapshot.user_ids)} users, {len(snapshot.book_ids)} books"
+        )
+        return True
+
+    async def start(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Initial ALS factor load failed: {e}")
+        self._refresh_task = asyncio.create_task(
+            refresh_periodically(self.refresh, self.refresh_interval, "ALS factor"))
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+
+store = FactorStore()
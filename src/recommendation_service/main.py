@@ -1,20 +1,41 @@
 import os
-import httpx
-from fastapi import FastAPI, Depends, Security, HTTPException
+import hmac
+import logging
+from http_client import get_client, start_client, close_client
+from fastapi import FastAPI, Depends, Security, HTTPException, Header, Query, Response
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
 import jwt
-import content_based_recommendation as cbr
 import random
-import collaborative_filtering as cf
+from candidate_generation import generate_candidates, SOURCES
 from typing import List
+from contextlib import asynccontextmanager
+from factor_store import store as factor_store
+from ann_index import store as ann_store
+from recommendation_cache import cache as recommendation_cache
+from book_cache import book_cache
+from user_cache import user_cache
+from singleflight import SingleFlight
+from seen_items import SEEN_EVENT_TYPES, overlay as seen_overlay, seen_rows
+from pydantic import BaseModel
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from metrics import IN_FLIGHT, register_cache, register_counter, time_stage
+import collaborative_filtering as cf
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 SECRET_KEY = os.getenv("SECRET_KEY")
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
+# Candidates asked of each source; they already exclude seen books, so only CB/ALS overlap needs slack over 25
+CANDIDATES_PER_SOURCE = int(os.getenv("CANDIDATES_PER_SOURCE", 30))
 ALGORITHM = "HS256"
 
+# Configure logging; uvicorn only sets up its own loggers, and the sampled
+# recommendation logs and factor/ANN refresh messages are INFO
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 headers = {
     "apikey": SUPABASE_KEY,
     "Authorization": f"Bearer {SUPABASE_KEY}",
@@ -23,7 +44,22 @@ headers = {
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_client()
+    # Load ALS factors once and keep them resident; refreshes happen in the background
+    await factor_store.start()
+    await ann_store.start()
+    try:
+        await book_cache.warm(fetch_all_books)
+    except Exception as e:
+        logger.warning(f"Book metadata cache warm-up failed: {e}")
+    yield
+    await factor_store.stop()
+    await ann_store.stop()
+    await close_client()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,49 +73,129 @@ def decode_access_token(token: str):
     return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
 async def get_user_by_username(username: str) -> Optional[dict]:
-    async with httpx.AsyncClient() as client:
-        params = {"username": f"eq.{username}"}
-        url = f"{SUPABASE_URL}/rest/v1/users"
-        response = await client.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        users = response.json()
-        return users[0] if users else None
+    client = get_client()
+    params = {"username": f"eq.{username}"}
+    url = f"{SUPABASE_URL}/rest/v1/users"
+    response = await client.get(url, headers=headers, params=params)
+    response.raise_for_status()
+    users = response.json()
+    return users[0] if users else None
 
 async def get_current_user(token: str = Security(oauth2_scheme)):
+    with time_stage("auth"):
+        return await _authenticate(token)
+
+async def _authenticate(token: str):
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
     try:
-        payload = decode_access_token(token)
-        username = payload.get("sub")
+        username = user_cache.subject_for(token, decode_access_token)
         if not username:
             raise credentials_exception
     except Exception:
         raise credentials_exception
-    user = await get_user_by_username(username)
+    user = await user_cache.get_user(username, get_user_by_username)
     if not user:
         raise credentials_exception
     return user
 
+BOOK_FIELDS = "id,title,authors,categories,thumbnail_url,download_link"
+
+async def _fetch_books_by_ids(ids: List[str]):
+    client = get_client()
+    idlist = ",".join([f'"{bid}"' for bid in ids])
+    url = f"{SUPABASE_URL}/rest/v1/books?select={BOOK_FIELDS}&id=in.({idlist})"
+    resp = await client.get(url, headers=headers)
+    resp.raise_for_status()
+    return resp.json()
+
+async def fetch_all_books(page_size: int = 1000) -> List[dict]:
+    all_books = []
+    offset = 0
+    client = get_client()
+    while True:
+        url = f"{SUPABASE_URL}/rest/v1/books?select={BOOK_FIELDS}&order=id&limit={page_size}&offset={offset}"
+        resp = await client.get(url, headers=headers)
+        resp.raise_for_status()
+        books = resp.json()
+        all_books.extend(books)
+        if len(books) < page_size:
+            break
+        offset += page_size
+    return all_books
+
 async def get_books_by_ids(ids: List[str]):
+    """
+    Book metadata in the order of ids; only ids missing from the local cache hit Supabase.
+    """
     if not ids:
         return []
-    async with httpx.AsyncClient() as client:
-        idlist = ",".join([f'"{bid}"' for bid in ids])
-        fields = "id,title,authors,categories,thumbnail_url,download_link"
-        url = f"{SUPABASE_URL}/rest/v1/books?select={fields}&id=in.({idlist})"
-        resp = await client.get(url, headers=headers)
-        resp.raise_for_status()
-        return resp.json()
+    return await book_cache.get_many(ids, _fetch_books_by_ids)
 
 
 import random
 
+# Concurrent requests for the same user, model version and cache generation share one computation
+recommendation_flight = SingleFlight()
+
+register_cache("recommendations", recommendation_cache)
+register_cache("book_metadata", book_cache)
+register_cache("user", user_cache)
+register_counter("singleflight", "executions", lambda: recommendation_flight.executions)
+register_counter("singleflight", "coalesced", lambda: recommendation_flight.coalesced)
+register_counter("singleflight", "in_flight", lambda: recommendation_flight.in_flight)
+register_counter("als_batcher", "batches", lambda: cf.batcher.batches)
+register_counter("als_batcher", "batched_requests", lambda: cf.batcher.batched_requests)
+
 @app.get("/api/v1/recommend/combined")
 async def recommend_combined(current_user: dict = Depends(get_current_user)):
-    user_id = str(current_user["id"])
+    with IN_FLIGHT.labels(endpoint="combined").track_inprogress():
+        user_id = str(current_user["id"])
+        model_version = factor_store.version
+        cached = recommendation_cache.get(user_id, model_version)
+        if cached is not None:
+            return {"recommendations": cached}
+
+        # An interaction event bumps the generation, so later requests don't join a stale flight
+        generation = recommendation_cache.generation(user_id)
+        recommendations = await recommendation_flight.do(
+            (user_id, model_version, generation),
+            lambda: compute_recommendations(user_id, model_version, generation)
+        )
+        return {"recommendations": recommendations}
+
+
+async def compute_recommendations(user_id: str, model_version: Optional[str], generation: int) -> List[dict]:
+    # 1. Get IDs and relevance scores from all sources concurrently; late sources are dropped
+    candidates = await generate_candidates(user_id, top_k=CANDIDATES_PER_SOURCE)
+
+    # 2-4. Deduplicate, take top 25 from each source and shuffle
+    with time_stage("merge"):
+        shuffled_ids, shuffled_scores = merge_candidates(candidates)
+
+    # 5. Fetch metadata for all recommended books
+    with time_stage("metadata"):
+        books = await get_books_by_ids(list(shuffled_ids))
+
+    # Merge scores with book metadata
+    book_score_dict = dict(zip(shuffled_ids, shuffled_scores))
+    recommendations = []
+    for book in books:
+        # Try both "id" and "_id" fields for robustness
+        book_id = book.get("id") or book.get("_id")
+        if book_id in book_score_dict:
+            book["relevance_score"] = book_score_dict[book_id]
+        recommendations.append(book)
+
+    # Don't pin a degraded response: only cache when every source made its deadline,
+    # and not at all if an interaction invalidated the user meanwhile
+    if len(candidates) == len(SOURCES):
+        recommendation_cache.set(user_id, model_version, recommendations, generation)
+    return recommendations
 
-    # 1. Get IDs and relevance scores
-    cb_book_ids, cb_scores = await cbr.dense_vector_recommendation(user_id, top_k=50)
-    als_book_ids, cf_scores = await cf.recommend_als_books(user_id, top_k=50)
+
+def merge_candidates(candidates: dict):
+    cb_book_ids, cb_scores = candidates.get("content_based", ([], []))
+    als_book_ids, cf_scores = candidates.get("als", ([], []))
 
     # 2. Deduplicate: remove any ALS IDs that are also in CB
     cb_set = set(cb_book_ids)
@@ -101,19 +217,110 @@ async def recommend_combined(current_user: dict = Depends(get_current_user)):
     combined = list(zip(all_ids, all_scores))
     random.shuffle(combined)
     combined = combined[:50]
-    shuffled_ids, shuffled_scores = zip(*combined) if combined else ([], [])
+    return zip(*combined) if combined else ([], [])
 
-    # 5. Fetch metadata for all recommended books
-    books = await get_books_by_ids(list(shuffled_ids))
 
-    # Merge scores with book metadata
-    book_score_dict = dict(zip(shuffled_ids, shuffled_scores))
-    recommendations = []
-    for book in books:
-        # Try both "id" and "_id" fields for robustness
-        book_id = book.get("id") or book.get("_id")
-        if book_id in book_score_dict:
-            book["relevance_score"] = book_score_dict[book_id]
-        recommendations.append(book)
+@app.get("/api/v1/recommend/popular")
+async def recommend_popular(genre: Optional[str] = None, top_k: int = Query(20, ge=1, le=200),
+                            current_user: dict = Depends(get_current_user)):
+    """
+    Most popular books overall or within one genre, from the ranking published
+    with the ALS factors. Also what cold-start users get from the ALS source.
+    """
+    with IN_FLIGHT.labels(endpoint="popular").track_inprogress():
+        snapshot = factor_store.snapshot
+        if snapshot is None or snapshot.popularity is None:
+            raise HTTPException(status_code=503, detail="Popular books are not available yet")
+        popular = snapshot.popular(top_k, genre, exclude_rows=seen_rows(snapshot, str(current_user["id"])))
+        if popular is None:
+            raise HTTPException(status_code=404, detail="Genre not found")
+        book_ids, scores = popular
+
+        with time_stage("metadata"):
+            books = await get_books_by_ids(book_ids)
+        score_by_id = dict(zip(book_ids, scores))
+        for book in books:
+            book_key = book.get("id") or book.get("_id")
+            if book_key in score_by_id:
+                book["relevance_score"] = score_by_id[book_key]
+        return {"genre": genre, "recommendations": books}
+
+
+@app.get("/api/v1/recommend/similar/{book_id}")
+async def recommend_similar(book_id: str, top_k: int = Query(20, ge=1, le=100),
+                            current_user: dict = Depends(get_current_user)):
+    """
+    "Readers who liked this also liked": the book's nearest neighbours in ALS
+    item-factor space, precomputed at training time.
+    """
+    with IN_FLIGHT.labels(endpoint="similar").track_inprogress():
+        snapshot = factor_store.snapshot
+        if snapshot is None or snapshot.similar_indptr is None:
+            raise HTTPException(status_code=503, detail="Similar books are not available yet")
+        with time_stage("similar_lookup"):
+            similar = snapshot.similar(book_id, top_k)
+        if similar is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        book_ids, scores = similar
+
+        with time_stage("metadata"):
+            books = await get_books_by_ids(book_ids)
+        score_by_id = dict(zip(book_ids, scores))
+        for book in books:
+            book_key = book.get("id") or book.get("_id")
+            if book_key in score_by_id:
+                book["relevance_score"] = score_by_id[book_key]
+        return {"book_id": book_id, "recommendations": books}
+
+
+def internal_token_valid(token: Optional[str]) -> bool:
+    # Constant-time comparison; internal endpoints are off without a configured token
+    return bool(INTERNAL_API_TOKEN) and token is not None and \
+        hmac.compare_digest(token.encode(), INTERNAL_API_TOKEN.encode())
+
+
+class InteractionEvent(BaseModel):
+    user_id: str
+    item_id: Optional[str] = None
+    event_type: str
+
+
+@app.post("/internal/v1/recommend/interactions")
+async def record_interaction(event: InteractionEvent, x_internal_token: Optional[str] = Header(None)):
+    """
+    Called by the user service when a user reads, bookmarks or reviews a book,
+    so their cached recommendations are recomputed on the next request and
+    the book is excluded from them.
+    """
+    if not internal_token_valid(x_internal_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if event.item_id and event.event_type in SEEN_EVENT_TYPES:
+        seen_overlay.add(event.user_id, event.item_id)
+    invalidated = recommendation_cache.invalidate(event.user_id)
+    return {"invalidated": invalidated}
+
+
+@app.get("/internal/v1/recommend/stats")
+async def recommendation_stats(x_internal_token: Optional[str] = Header(None)):
+    if not internal_token_valid(x_internal_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {
+        "singleflight": {
+            "executions": recommendation_flight.executions,
+            "coalesced": recommendation_flight.coalesced,
+            "in_flight": recommendation_flight.in_flight,
+        },
+        "recommendation_cache": {
+            "size": len(recommendation_cache),
+            "hits": recommendation_cache.hits,
+            "misses": recommendation_cache.misses,
+        },
+        "seen_overlay": {
+            "users": len(seen_overlay),
+        },
+    }
+
 
-    return {"recommendations": recommendations}
+@app.get("/metrics")
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
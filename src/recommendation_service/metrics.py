@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import random
+import logging
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+
+RECOMMENDATION_LOG_SAMPLE_RATE = float(os.getenv("RECOMMENDATION_LOG_SAMPLE_RATE", 0.01))
+# Ids included in a sampled log line; the rest are only counted
+LOG_MAX_IDS = 5
+
+STAGE_LATENCY = Histogram(
+    "recommendation_stage_seconds",
+    "Latency of each recommendation pipeline stage",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+IN_FLIGHT = Gauge(
+    "recommendation_in_flight_requests",
+    "Requests currently being served",
+    ["endpoint"],
+)
+SOURCE_TIMEOUTS = Counter(
+    "recommendation_source_timeouts_total",
+    "Candidate sources that missed their deadline",
+    ["source"],
+)
+SOURCE_ERRORS = Counter(
+    "recommendation_source_errors_total",
+    "Candidate sources that raised",
+    ["source"],
+)
+CACHE_LOOKUPS = Gauge(
+    "recommendation_cache_lookups",
+    "Cache lookups since start, by result",
+    ["cache", "result"],
+)
+CACHE_HIT_RATIO = Gauge(
+    "recommendation_cache_hit_ratio",
+    "Cache hits / lookups since start",
+    ["cache"],
+)
+COUNTERS = Gauge(
+    "recommendation_component_counter",
+    "Internal counters of recommendation components",
+    ["component", "counter"],
+)
+
+
+@contextmanager
+def time_stage(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - started)
+
+
+def register_cache(name: str, cache):
+    """Export hit/miss counts and hit ratio of any cache with `hits` and `misses` attributes."""
+    CACHE_LOOKUPS.labels(cache=name, result="hit").set_function(lambda: cache.hits)
+    CACHE_LOOKUPS.labels(cache=name, result="miss").set_function(lambda: cache.misses)
+    CACHE_HIT_RATIO.labels(cache=name).set_function(
+        lambda: cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0)
+
+
+def register_counter(component: str, counter: str, read):
+    COUNTERS.labels(component=component, counter=counter).set_function(read)
+
+
+def log_sampled(logger: logging.Logger, event: str, **fields):
+    """
+    Emit a JSON log line for a random sample of calls. Lists are summarised to
+    their length and first few items so a line stays small.
+    """
+    if random.random() >= RECOMMENDATION_LOG_SAMPLE_RATE:
+        return
+    record = {"event": event}
+    for key, value in fields.items():
+        if isinstance(value, (list, tuple)):
+            record[f"{key}_count"] = len(value)
+            record[key] = list(value[:LOG_MAX_IDS])
+        else:
+            record[key] = value
+    logger.info(json.dumps(record, default=str))
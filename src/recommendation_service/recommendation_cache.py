@@ -0,0 +1,66 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", 10000))
+RECOMMENDATION_CACHE_TTL_SECONDS = float(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", 300))
+
+
+class RecommendationCache:
+    """
+    Bounded LRU + TTL cache of each user's final recommendation list.
+    An entry only matches the model version it was computed with, so a factor
+    hot-swap implicitly invalidates everything. Each invalidation also bumps the
+    user's generation, so a computation that started before it can't cache its
+    now-stale result. Lives in one worker process and is only touched from the
+    event loop, hence no locking.
+    """
+
+    def __init__(self, max_size: int = RECOMMENDATION_CACHE_SIZE, ttl: float = RECOMMENDATION_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str, model_version: Optional[str]) -> Optional[Any]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        version, expires_at, value = entry
+        if version != model_version or expires_at < time.monotonic():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return value
+
+    def generation(self, user_id: str) -> int:
+        return self._generations.get(user_id, 0)
+
+    def set(self, user_id: str, model_version: Optional[str], value: Any, generation: Optional[int] = None) -> bool:
+        # Invalidated while being computed: the value predates the event
+        if generation is not None and generation != self.generation(user_id):
+            return False
+        self._entries[user_id] = (model_version, time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, user_id: str) -> bool:
+        self._generations[user_id] = self.generation(user_id) + 1
+        self._generations.move_to_end(user_id)
+        while len(self._generations) > self.max_size:
+            self._generations.popitem(last=False)
+        return self._entries.pop(user_id, None) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = RecommendationCache()
@@ -0,0 +1,69 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Set
+import numpy as np
+from factor_store import FactorSnapshot, store
+
+SEEN_OVERLAY_SIZE = int(os.getenv("SEEN_OVERLAY_SIZE", 100000))
+# Must outlast the gap between an event and the next published model that trained on it
+SEEN_OVERLAY_TTL_SECONDS = float(os.getenv("SEEN_OVERLAY_TTL_SECONDS", 2 * 24 * 3600))
+SEEN_EVENT_TYPES = {"read", "bookmark_add", "review"}
+
+
+class SeenOverlay:
+    """
+    Books users consumed after the published model was trained, fed by the
+    interactions endpoint. Bounded LRU + TTL per user; the training-time seen
+    sets in the factor snapshot cover everything older. Lives in one worker
+    process and is only touched from the event loop, hence no locking.
+    """
+
+    def __init__(self, max_size: int = SEEN_OVERLAY_SIZE, ttl: float = SEEN_OVERLAY_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def add(self, user_id: str, book_id: str):
+        entry = self._entries.get(user_id)
+        books = entry[1] if entry is not None and entry[0] >= time.monotonic() else set()
+        books.add(str(book_id))
+        self._entries[user_id] = (time.monotonic() + self.ttl, books)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, user_id: str) -> Set[str]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return set()
+        expires_at, books = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return set()
+        return set(books)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+overlay = SeenOverlay()
+
+
+def seen_rows(snapshot: FactorSnapshot, user_id: str) -> np.ndarray:
+    """Sorted book rows of the snapshot the user has consumed, including events since training."""
+    rows = snapshot.seen(user_id)
+    recent = overlay.get(user_id)
+    if recent:
+        recent_rows = [row for row in (snapshot.book_row(b) for b in recent) if row is not None]
+        rows = np.union1d(rows, np.asarray(recent_rows, dtype=np.int32))
+    return rows
+
+
+def seen_book_ids(user_id: str, snapshot: Optional[FactorSnapshot] = None) -> Set[str]:
+    """Ids of every book the user has consumed, for sources that don't work on book rows."""
+    snapshot = store.snapshot if snapshot is None else snapshot
+    books = overlay.get(user_id)
+    if snapshot is not None:
+        books.update(snapshot.book_ids[snapshot.seen(user_id)].tolist())
+    return books
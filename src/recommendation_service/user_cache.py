@@ -0,0 +1,98 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 30))
+
+
+class _LRU:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str):
+        self._entries.pop(key, None)
+
+
+class UserCache:
+    """
+    Short-TTL caches for get_current_user: verified token -> subject, and
+    subject -> user record. Concurrent misses for the same subject share one fetch.
+    Only touched from the event loop, hence no locking.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._tokens = _LRU(max_size)
+        self._users = _LRU(max_size)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def subject_for(self, token: str, decode: Callable[[str], dict]) -> Optional[str]:
+        """
+        Subject of a token, decoding (and so verifying) it only on first sight.
+        Cached subjects never outlive the token's own exp claim.
+        """
+        subject = self._tokens.get(token)
+        if subject is not None:
+            return subject
+        payload = decode(token)
+        subject = payload.get("sub")
+        if subject:
+            expires_at = min(time.time() + self.ttl, float(payload.get("exp", float("inf"))))
+            self._tokens.put(token, subject, expires_at)
+        return subject
+
+    async def get_user(self, subject: str, fetch: Callable[[str], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        user = self._users.get(subject)
+        if user is not None:
+            self.hits += 1
+            return dict(user)
+        self.misses += 1
+        task = self._inflight.get(subject)
+        if task is None:
+            task = asyncio.ensure_future(self._load(subject, fetch))
+            self._inflight[subject] = task
+        # Shielded so one caller going away doesn't cancel the fetch the others wait on
+        user = await asyncio.shield(task)
+        return dict(user) if user is not None else None
+
+    async def _load(self, subject: str, fetch) -> Optional[dict]:
+        task = asyncio.current_task()
+        try:
+            user = await fetch(subject)
+            # Skip the store if the entry was invalidated while the fetch was in flight
+            if user is not None and self._inflight.get(subject) is task:
+                self._users.put(subject, user, time.time() + self.ttl)
+            return user
+        finally:
+            if self._inflight.get(subject) is task:
+                del self._inflight[subject]
+
+    def invalidate(self, subject: str):
+        self._users.pop(subject)
+        self._inflight.pop(subject, None)
+
+
+user_cache = UserCache()
@@ -18,7 +18,7 @@ from supabase_client import (
     create_preferences, get_user_bookmark_ids, get_books_by_ids,
     get_preferences_by_user_id, save_review_and_rating_to_db,
     update_user_profile, get_popular_authors_from_db, end_session, create_session, get_reviews_and_avg_rating_from_db,
-    get_user_profile_by_id
+    get_user_profile_by_id, fetch_all_books
 )
 from neo4j_client import (create_user_follows_users, delete_user_follows_user, create_user_read_book, create_user_bookmarked_book, update_user_profile_fields,
                           delete_user_bookmarked_book, create_user_rated_book, create_user_preferences, patch_user_preferences, neo4j_suggest_followers, 
@@ -36,6 +36,10 @@ from io import BytesIO
 import zipfile
 import mimetypes
 from produce import send_click_event
+from book_cache import book_cache
+from user_cache import user_cache
+from contextlib import asynccontextmanager
+from http_client import start_client, close_client
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -48,7 +52,18 @@ pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 S3_BUCKET_URL_TEMPLATE = "https://bibliophileai.s3.us-east-2.amazonaws.com/books-epub/{book_id}.epub"
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for all Supabase calls, instead of a new connection per query
+    await start_client()
+    try:
+        await book_cache.warm(fetch_all_books)
+    except Exception as e:
+        logger.warning(f"Book metadata cache warm-up failed: {e}")
+    yield
+    await close_client()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -62,13 +77,12 @@ app.add_middleware(
 async def get_current_user(token: str = Security(oauth2_scheme)):
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
     try:
-        payload = decode_access_token(token)
-        username = payload.get("sub")
+        username = user_cache.subject_for(token, decode_access_token)
         if not username:
             raise credentials_exception
     except Exception:
         raise credentials_exception
-    user = await get_user_by_username(username)
+    user = await user_cache.get_user(username, get_user_by_username)
     if not user:
         raise credentials_exception
     return user
@@ -276,6 +290,7 @@ async def save_preferences(
             age=prefs_in.age,
             pincode=prefs_in.pincode
         )
+        user_cache.invalidate(current_user["username"])
         logger.info(f"Prefenece result  for user {user_id}: {preferences_result}")
         # Create embedding vectors for recommendation system
         try:
@@ -393,6 +408,7 @@ async def patch_preferences(
     if not preferences_result:
         logger.error(f"Failed to patch preferences for user {user_id}")
         raise HTTPException(status_code=500, detail="Failed to patch preferences")
+    user_cache.invalidate(current_user["username"])
 
     logger.info(f"PATCH preference result for user {user_id}: {preferences_result}")
     try:
@@ -512,7 +528,8 @@ async def save_profile(
             user_id=user_id,
             age=prefs_in.age,
             pincode=prefs_in.pincode
-        ) 
+        )
+        user_cache.invalidate(current_user["username"])
         session_info = await get_current_active_session_id(user_id)
         session_id = session_info["session_id"] if session_info else None   
         event = {
@@ -724,13 +741,9 @@ async def get_user_bookmarks(current_user=Depends(get_current_user)):
         if not book_ids:
             return {"bookmarks": []}
 
-        # Step 2: Fetch full book details
+        # Step 2: Fetch full book details (returned in bookmarked_at order, newest first)
         books = await get_books_by_ids(book_ids)
 
-        # Optional: Preserve order by bookmarked_at (if needed)
-        # books are returned in order from get_user_bookmark_ids → get_books_by_ids doesn't guarantee order
-        # You can sort here if you stored timestamps (not needed if order isn't critical)
-
         return {"bookmarks": books}
 
     except httpx.HTTPStatusError as e:
@@ -2,9 +2,39 @@
 import os
 import boto3
 import json
+import logging
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
 
 sqs = boto3.client("sqs")
 QUEUE_URL = os.environ["SQS_QUEUE_URL"]
+RECOMMENDATION_SERVICE_URL = os.getenv("RECOMMENDATION_SERVICE_URL", "http://recommendation-service:8001")
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
+
+# Events that change what we should recommend to the user; preferences_update re-embeds
+# the user's vector the content-based source queries with
+RECOMMENDATION_EVENT_TYPES = {"read", "bookmark_add", "bookmark_remove", "review", "preferences_update"}
+
+# Notifications are fire-and-forget so the request path never waits on the recommendation service
+_notify_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="recommendation-notify")
+
+def _notify_recommendation_service(event: dict):
+    try:
+        resp = httpx.post(
+            f"{RECOMMENDATION_SERVICE_URL}/internal/v1/recommend/interactions",
+            json={
+                "user_id": str(event["user_id"]),
+                "item_id": event.get("item_id"),
+                "event_type": event["event_type"]
+            },
+            headers={"X-Internal-Token": INTERNAL_API_TOKEN or ""},
+            timeout=1.0
+        )
+        resp.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Recommendation cache invalidation failed for user {event.get('user_id')}: {e}")
 
 def send_click_event(event: dict, group_id: str):
     resp = sqs.send_message(
@@ -12,4 +42,6 @@ def send_click_event(event: dict, group_id: str):
         MessageBody=json.dumps(event),
         MessageGroupId=group_id
     )
+    if event.get("event_type") in RECOMMENDATION_EVENT_TYPES and INTERNAL_API_TOKEN:
+        _notify_executor.submit(_notify_recommendation_service, event)
     return resp["MessageId"]